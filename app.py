@@ -1,16 +1,33 @@
-import base64
-import io
+from timing import PhaseTimer
+
+# started before the other imports so that they are timed as well
+startup = PhaseTimer('startup')
+
 import dash_bootstrap_components as dbc
+import flask
 import numpy as np
 import pandas as pd
-from PIL import Image
-from dash import dash, html, dcc, Input, Output, State, no_update
+from dash import dash, html, dcc, Input, Output, State, ClientsideFunction, callback_context, no_update
+import dataset
 import db_map
 import db_overview
-import utils
+import filter_cache
+import images
+import map_pyramid
+import metrics
+import overview_selection
+import profiling
+import session_store
+from lru import SizedLRUCache
 from utils import is_retrofit
 from pathlib import Path
+from urllib.parse import quote
+import json
+import logging
 import os
+import threading
+
+startup.mark('imports')
 
 external_stylesheets = [dbc.themes.BOOTSTRAP]
 
@@ -23,21 +40,32 @@ app = dash.Dash(
 
 server = app.server
 
+logging.basicConfig(level=os.getenv('UIPV_APP_LOG_LEVEL', 'INFO'))
+# profiles of single callback requests on demand, when a token is configured
+profiling.init_profiling(server)
+# latency and payload histograms of every callback, served on /metrics
+metrics.init_metrics(app)
+
 
 PARENT_DIR = Path(__file__).parent.resolve()
 assets_dir = os.path.join(PARENT_DIR, 'assets')
 
-about_file = open(os.path.join(assets_dir, 'about_description.txt'), 'r')
+about_path = os.path.join(assets_dir, 'about_description.txt')
 
 
 def generate_dataframe(cols=None):
-    data = pd.read_csv(os.path.join(assets_dir, 'database_display.csv'),
-                       index_col="Unnamed: 0",
-                       usecols=cols)
-    return data
+    # parsed once per worker, shared read-only between callbacks
+    return dataset.get_dataset().select(cols)
 
 
+startup.mark('app setup')
+
+# loaded before the first request rather than by it
 data_intitial = generate_dataframe()
+# sized by the bitmap of a result, one bit per project
+filter_cache.init_cache(server, n_rows=len(data_intitial))
+startup.mark('data load')
+
 filter_fields = ['Project Built Year',
                  'Project Function Clean',
                  'System Type Clean',
@@ -174,98 +202,134 @@ def build_layout():
     ], id='page')
 
 
-layout = build_layout()
+def build_about_page():
+    with open(about_path, 'r') as fp:
+        about_text = fp.read()
+    return html.Div([
+        html.H3('The Repository for Integrated Solar Energy in the Built Environment',
+                style={"color": "white"}),
+        html.P(about_text, id='abstract')
+    ], id='about_page')
+
+
+def marker_url(ds):
+    return app.get_relative_path(f'/map-markers/{quote(str(ds.version))}.json')
+
+
+def build_map_page():
+    return html.Div([
+        dcc.Store(data=None,  # no token means every project
+                  id='dataframe_temp'),
+        dcc.Store(data=None,
+                  id='map_markers'),
+        # the markers of every project, fetched by the browser from a url of
+        # the dataset version that it caches like any other static file
+        dcc.Store(data=marker_url(dataset.get_dataset()),
+                  id='marker_url'),
+        dcc.Store(data=None,
+                  id='marker_cache'),
+        # the pyramid level of the map's zoom and the clusters drawn at it
+        dcc.Store(data={'level': map_pyramid.zoom_level(None),
+                        'cluster_zoom': map_pyramid.cluster_zoom},
+                  id='map_level'),
+        dcc.Store(data=None,
+                  id='map_clusters'),
+        # html.Div(children=[
+        #         dash_table.DataTable(
+        #             id='memory-table',
+        #             columns=[{'name': i, 'id': i} for i in data_intitial.columns if "Project" in i]
+        #         ),
+        #     ]),
+        html.Div(children=[
+            db_map.legend_table_sizes(),
+            db_map.legend_table_colors(),
+        ],
+            id="map_legend_container",
+            className="map_overlay"
+        ),
+        db_map.create_filter_container(filter_fields,
+                                       data_intitial),
+        # the points are added in the browser from the fetched markers
+        dcc.Graph(
+            id='map',
+            figure=db_map.generate_bipv_db_map_2(),
+            responsive=True,
+            # animate=True,
+            clear_on_unhover=True,
+            config={"displayModeBar": False}),
+        dcc.Tooltip(
+            id="graph_tooltip",
+            loading_text="Loading..."),
+        html.Div(children=[db_map.map_modal()
+                           ]
+                 ),
+    ], className='content_container')
+
+
+def build_overview_page():
+    return html.Div(children=[
+        dcc.Dropdown(options=list(db_overview.get_overview_builders()),
+                     value='Year and Type',
+                     id='graph_selector'),
+        html.Div(children=[
+        ], id='overview_graphs_target',
+            className='overview_graph_box'),
+    ],
+        className='overview_container')
 
-layout_about_page = html.Div([
-    html.H3('The Repository for Integrated Solar Energy in the Built Environment',
-            style={"color": "white"}),
-    html.P(about_file.read(), id='abstract')
-], id='about_page')
 
-layout_map_page = html.Div([
-    dcc.Store(data=data_intitial.to_dict(),
-              id='dataframe_init'),
-    dcc.Store(data=None,
-              id='dataframe_temp'),
-    # html.Div(children=[
-    #         dash_table.DataTable(
-    #             id='memory-table',
-    #             columns=[{'name': i, 'id': i} for i in data_intitial.columns if "Project" in i]
-    #         ),
-    #     ]),
-    html.Div(children=[
-        db_map.legend_table_sizes(),
-        db_map.legend_table_colors(),
-    ],
-        id="map_legend_container",
-        className="map_overlay"
-    ),
-    db_map.create_filter_container(filter_fields,
-                                   data_intitial),
-    dcc.Graph(
-        id='map',
-        figure=db_map.generate_bipv_db_map_2(data_intitial),
-        responsive=True,
-        # animate=True,
-        clear_on_unhover=True,
-        config={"displayModeBar": False}),
-    dcc.Tooltip(
-        id="graph_tooltip",
-        loading_text="Loading..."),
-    html.Div(children=[db_map.map_modal()
-                       ]
-             ),
-], className='content_container')
-
-# layout_overview_page = None
-
-layout_overview_page = html.Div(children=[
-    dcc.Store(data=data_intitial.to_dict(),
-              id='dataframe_init'),
-    dcc.Dropdown(options=['Year and Type',
-                          'Generation and Capacity',
-                          'Surface Area and Yield',
-                          'Surface Type'],
-                 value='Year and Type',
-                 id='graph_selector'),
-    html.Div(children=[
-    ], id='overview_graphs_target',
-        className='overview_graph_box'),
-],
-    className='overview_container')
+page_builders = {'/page-about': build_about_page,
+                 '/page-map': build_map_page,
+                 '/page-overview': build_overview_page}
+
+# each page is built on its first visit and the same layout served after that
+_pages = dict()
+_pages_lock = threading.Lock()
+
+
+def get_page(pathname):
+    if pathname not in page_builders:
+        pathname = '/page-about'
+    page = _pages.get(pathname)
+    if page is None:
+        with _pages_lock:
+            page = _pages.get(pathname)
+            if page is None:
+                timer = PhaseTimer(f'page {pathname}')
+                page = _pages[pathname] = page_builders[pathname]()
+                timer.mark('layout build')
+                timer.log()
+    return page
+
+
+layout = build_layout()
 
 url_bar_and_content_div = html.Div([
     dcc.Location(id='url', refresh=False),
+    # the map's result token, kept while the map page is not rendered so the
+    # overview can follow the map filters
+    dcc.Store(data=None,
+              id='filter_token'),
     layout
 ])
 
-# index layout
+# index layout; page layouts are only checked against the callbacks when
+# callback exceptions are not suppressed, so no validation layout is set
 app.layout = url_bar_and_content_div
-
-# "complete" layout
-app.validation_layout = html.Div([
-    url_bar_and_content_div,
-    layout,
-    layout_about_page,
-    layout_map_page,
-])
+startup.mark('layout build')
+startup.log()
 
 
 @app.callback(Output('overview_graphs_target', 'children'),
               Input('graph_selector', 'value'),
-              Input('dataframe_init', 'data'))
-def update_overview_graph(option, data_store):
-    data = generate_dataframe()  # pd.DataFrame.from_dict(data_store)
-    if option == 'Year and Type':
-        fig = db_overview.make_projects_by_year(data)
-    elif option == 'Generation and Capacity':
-        fig = db_overview.make_projects_by_generation_capacity(data)
-    elif option == 'Surface Area and Yield':
-        fig = db_overview.make_projects_by_coverage_yield(data)
-    elif option == 'Surface Type':
-        fig = db_overview.make_surface_type_plot(data)
-    else:
+              State('filter_token', 'data'))
+def update_overview_graph(option, selection):
+    if option not in db_overview.get_overview_builders():
         return html.H4("No Option")
+    try:
+        fig = overview_selection.overview_figure(option, selection)
+    except overview_selection.SelectionExpired:
+        return html.H4("The map selection has expired, re-apply the filters")
     return dcc.Graph(
         figure=fig,
         responsive=True,
@@ -276,23 +340,15 @@ def update_overview_graph(option, data_store):
 @app.callback(Output('body_col_child', 'children'),
               Input('url', 'pathname'))
 def display_page(pathname):
-    if pathname == "/page-about":
-        return layout_about_page
-    elif pathname == "/page-map":
-        return layout_map_page
-    elif pathname == "/page-overview":
-        return layout_overview_page
-    else:
-        return layout_about_page
+    return get_page(pathname)
 
 
 @app.callback(
     Output("graph_tooltip", "show"),
     Output("graph_tooltip", "bbox"),
     Output("graph_tooltip", "children"),
-    [Input("map", "hoverData"),
-     State('dataframe_init', 'data')])
-def display_hover(hover_data, data_store):
+    [Input("map", "hoverData")])
+def display_hover(hover_data):
     if hover_data is None:
         return False, no_update, no_update
     else:
@@ -307,15 +363,13 @@ def display_hover(hover_data, data_store):
         #               'Project Description']
 
         # df = generate_dataframe(cols=hover_cols)
-        df = pd.DataFrame.from_dict(data_store)
         pt = hover_data["points"][0]
         bbox = pt["bbox"]
 
-        hover_lat = hover_data["points"][0]['lat']
-        hover_lon = hover_data["points"][0]['lon']
-        match = df[df['Project Latitude'] == hover_lat]
-        match = match[match['Project Longitude'] == hover_lon]
-        data_row = match.reset_index(drop=True).iloc[0]
+        if pt.get('curveNumber') == 1:
+            return True, bbox, cluster_tooltip(*pt['customdata'])
+
+        data_row = dataset.get_dataset().project(pt['customdata'])
 
         img_src = data_row['Image Name']
         name = data_row['Project Name']
@@ -327,15 +381,7 @@ def display_hover(hover_data, data_store):
         year = data_row['Project Plant Year'].astype(int)
         desc = data_row['Project Description']
 
-        if img_src is np.nan:
-            image_path = os.path.join(assets_dir, 'images','placeholder.jpg')
-        else:
-            image_path = os.path.join(assets_dir, 'images',f'{img_src}.jpg')
-        im = Image.open(image_path)
-        buffer = io.BytesIO()
-        im.save(buffer, format="jpeg")
-        encoded_image = base64.b64encode(buffer.getvalue()).decode()
-        img_src = "data:image/jpeg;base64, " + encoded_image
+        img_src = images.encode_image(img_src, 'thumb')
 
         if desc is np.nan:
             desc = 'No description available'
@@ -362,25 +408,33 @@ def display_hover(hover_data, data_store):
         return True, bbox, children
 
 
+def cluster_tooltip(count, generation):
+    return [
+        html.Div(children=[
+            html.H2(f"{count} projects", id="hover_name"),
+            html.P(f"{generation:,.0f} kWh/year generation"),
+            html.P("Zoom in to see the single projects"),
+        ],
+            className='map_hover_box')
+    ]
+
+
 @app.callback(
     Output('map_modal', 'style'),
     Output("map_modal", "children"),
     # Output("modal_close_button", "style"),
-    [Input('map', 'clickData'),
-     State('dataframe_init', 'data')])
-def show_modal(click_data, data_store):
+    [Input('map', 'clickData')])
+def show_modal(click_data):
     if click_data == None:
         return {"display": "none"}, None  # , {"display": "none"}
+    elif click_data["points"][0].get('curveNumber') == 1:
+        # a cluster, not a project
+        return no_update, no_update
     else:
-        df = pd.DataFrame.from_dict(data_store)
         pt = click_data["points"][0]
         bbox = pt["bbox"]
 
-        hover_lat = click_data["points"][0]['lat']
-        hover_lon = click_data["points"][0]['lon']
-        match = df[df['Project Latitude'] == hover_lat]
-        match = match[match['Project Longitude'] == hover_lon]
-        data_row = match.reset_index(drop=True).iloc[0]
+        data_row = dataset.get_dataset().project(pt['customdata'])
 
         img_src = data_row['Image Name']
         name = data_row['Project Name']
@@ -390,21 +444,12 @@ def show_modal(click_data, data_store):
             link = None
             ext_link_id = "link_unavailable"
 
-        if img_src is np.nan:
-            image_path = os.path.join(assets_dir, 'images','placeholder.jpg')
+        if images.image_name_or_placeholder(img_src) == images.placeholder_name:
             image_text = "image unavailable"
         else:
-            image_path = os.path.join(assets_dir, 'images',f'{img_src}.jpg')
-            if img_src == "placeholder":
-                image_text = "image unavailable"
-            else:
-                image_text = ""  # data_row['Project Link']
-
-        im = Image.open(image_path)
-        buffer = io.BytesIO()
-        im.save(buffer, format="jpeg")
-        encoded_image = base64.b64encode(buffer.getvalue()).decode()
-        img_src = "data:image/jpeg;base64, " + encoded_image
+            image_text = ""  # data_row['Project Link']
+
+        img_src = images.encode_image(img_src, 'medium')
 
         # for the table in the modal
         proj_cols = ["Project Country",
@@ -497,7 +542,7 @@ def update_popover(n, id):
     return {"display": "none"}
 
 
-@app.callback(Output('map', 'figure'),
+@app.callback(Output('map_markers', 'data'),
               Output('dataframe_temp', 'data'),
               [Input('filter_built_year', 'value'),
                Input('filter_project_function', 'value'),
@@ -510,75 +555,164 @@ def update_popover(n, id):
                Input('filter_cell_types', 'value'),
                Input('filter_transparency', 'value'),
                Input('filter_input_description', 'value'),
-               State('dataframe_init', 'data'),
-               Input('map', 'relayoutData')])
+               Input('map_level', 'data'),
+               State('dataframe_temp', 'data')],
+              # the unfiltered markers are fetched from /map-markers/ and
+              # pan/zoom is left to the browser, so only filter edits and
+              # zoom level changes get here
+              prevent_initial_call=True)
 def filter_data(date_range, functions, sys_type, elements, coverage,
                 sp_yield, generation, orientation, cells, transparency,
-                search_term,
-                data, map_info):
-    if map_info == None:
-        df_init = generate_dataframe()
-        map = db_map.generate_bipv_db_map_2(df_init)
-        return map, df_init.to_dict()
+                search_term, level, previous):
+    if [t['prop_id'] for t in callback_context.triggered] == ['map_level.data']:
+        # only the zoom changed, the selection is looked up instead of filtered
+        return level_markers(level, previous), no_update
+    return filter_map(date_range, functions, sys_type, elements, coverage,
+                      sp_yield, generation, orientation, cells, transparency,
+                      search_term, level, previous)
+
+
+def is_clustered(level):
+    return level is not None and level['level'] is not None
+
+
+def selection_markers(ds, positions):
+    if len(positions) == len(ds):
+        # every project, as fetched with the marker url
+        return None
+    # only the marker arrays are sent, the map layout and camera stay as they are
+    return db_map.encode_marker_arrays(ds.frame.iloc[positions])
+
+
+def level_markers(level, selection):
+    # the clusters carry the projects alone in their cell, the markers of the
+    # selection are only needed once the single projects show
+    if is_clustered(level) or selection is None:
+        return no_update
+    ds = dataset.get_dataset()
+    try:
+        token, positions = overview_selection.selection_positions(ds, selection)
+    except overview_selection.SelectionExpired:
+        return no_update
+    return selection_markers(ds, positions)
+
+
+def filter_map(date_range, functions, sys_type, elements, coverage,
+               sp_yield, generation, orientation, cells, transparency,
+               search_term, level, previous):
+    # all predicates are combined before rows are materialised, and the
+    # result is shared between workers for equal filter selections
+    ds = dataset.get_dataset()
+    token, positions = filter_cache.cached_filter_positions(ds,
+                                                            date_range, functions, sys_type, elements,
+                                                            coverage, sp_yield, generation, orientation,
+                                                            cells, transparency, search_term)
+    previous_token = previous['token'] if previous else None
+    if token == previous_token or (previous_token is None and len(positions) == len(ds)):
+        # an edit that leaves the selection as it is
+        return no_update, no_update
+    selection = overview_selection.map_selection(token, date_range, functions, sys_type, elements,
+                                                 coverage, sp_yield, generation, orientation,
+                                                 cells, transparency, search_term)
+    markers = no_update if is_clustered(level) else selection_markers(ds, positions)
+    # only the token and the filter state go to the browser
+    session_store.result_store.put(token, positions, version=ds.version)
+    # the overview of the selection follows it, updated by this edit
+    overview_selection.track_selection(ds, token, positions, previous_token)
+    return markers, selection
+
+
+_all_markers = dict()
+
+
+def all_markers_json(ds):
+    # serialised once per dataset version
+    if ds.version not in _all_markers:
+        _all_markers.clear()
+        markers = db_map.encode_marker_arrays(ds.frame)
+        _all_markers[ds.version] = json.dumps({'version': ds.version, 'markers': markers})
+    return _all_markers[ds.version]
+
+
+@server.route('/map-markers/<version>.json')
+def serve_markers(version):
+    # the url names the dataset version, so a response never goes stale and
+    # the browser can keep it; other versions get the current markers uncached
+    ds = dataset.get_dataset()
+    response = flask.Response(all_markers_json(ds), mimetype='application/json')
+    response.set_etag(str(ds.version))
+    if version == str(ds.version):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
     else:
-        if len(map_info.keys()) == 1:
-            autosize = True
-            lat = 40
-            lon = 145
-            zoom = None
-        else:
-            autosize = False
-            lat = map_info['mapbox.center']['lat']
-            lon = map_info['mapbox.center']['lon']
-            zoom = map_info['mapbox.zoom']
-        # load dataframe from memory store
-        df = pd.DataFrame.from_dict(data)
-
-        # filtering
-        df = utils.filter_df_list_mixed_type(df,  # filter plant year
-                                             date_range,
-                                             "Project Built Year",
-                                             clip=(1945, None))
-        df = utils.filter_df_list(df,
-                                  functions,
-                                  "Project Function Clean")
-        df = utils.filter_df_list(df,
-                                  sys_type,
-                                  "System Type Clean")
-        df = utils.filter_df_list(df,
-                                  elements,
-                                  "Simple System Building Element")
-        df = utils.filter_df_range(df,
-                                   coverage,
-                                   "System Coverage")
-        df = utils.filter_df_range(df,  # filter specific yield
-                                   sp_yield,
-                                   "System Specific Yield",
-                                   new_dtype=float)
-        df = utils.filter_df_range(df,  # filter generation
-                                   generation,
-                                   "System Generation",
-                                   new_dtype=float)
-        df = utils.filter_df_list_mixed_type(df,
-                                             orientation,
-                                             "Array Orientation(s) Clean")
-        df = utils.filter_df_list(df,
-                                  cells,
-                                  "Module Cell Type(s)")
-        # df = utils.filter_df_range(df,  # filter transparency
-        #                            transparency,
-        #                            "Module Transparency",
-        #                            new_dtype=float)
-        df = utils.search_string_field(df,
-                                       ['Project Name','Project Description'],
-                                       search_term)
-        # render map
-        map = db_map.generate_bipv_db_map_2(df,
-                                            lat=lat,
-                                            lon=lon,
-                                            autosize=autosize,
-                                            zoom=zoom)
-        return map, df.to_dict()  # important to change DF to a dict for the store
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(flask.request)
+
+
+# fetched when the map page is shown, not before
+app.clientside_callback(
+    ClientsideFunction(namespace='map', function_name='load_markers'),
+    Output('marker_cache', 'data'),
+    Input('marker_url', 'data'))
+
+
+# clusters of filtered selections, by dataset version, result token and level
+cluster_cache = SizedLRUCache(8 * 1024 * 1024)
+
+
+def map_clusters(level, selection=None):
+    ds = dataset.get_dataset()
+    # no selection means every project, precomputed per level
+    token, positions = overview_selection.selection_positions(ds, selection)
+    key = (ds.version, token, level)
+    clusters_json = cluster_cache.get(key)
+    if clusters_json is None:
+        cells = ds.pyramid.level_cells(level, None if positions is None else np.sort(positions))
+        clusters = db_map.encode_cluster_arrays(ds.frame, cells)
+        clusters_json = cluster_cache.put(key, json.dumps(dict(clusters, level=level)))
+    return json.loads(clusters_json)
+
+
+# a new pyramid level only when the zoom crosses a whole zoom level, panning
+# and zooming within it stay in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='map', function_name='zoom_level'),
+    Output('map_level', 'data'),
+    Input('map', 'relayoutData'),
+    State('map_level', 'data'))
+
+
+@app.callback(Output('map_clusters', 'data'),
+              Input('map_level', 'data'),
+              Input('dataframe_temp', 'data'))
+def update_clusters(level, selection):
+    if level is None or level['level'] is None:
+        # zoomed in far enough for single projects
+        return None
+    try:
+        return map_clusters(level['level'], selection)
+    except overview_selection.SelectionExpired:
+        # the overview asks for the filters again, the map keeps what it shows
+        return no_update
+
+
+# copy the token out of the map page; a freshly rendered map page starts
+# without one, which resets the overview to every project as well
+app.clientside_callback(
+    """function (token) { return token; }""",
+    Output('filter_token', 'data'),
+    Input('dataframe_temp', 'data'))
+
+
+# swap the new marker arrays into the figure in the browser: the clusters of
+# the zoom level if zoomed out, otherwise the filtered markers if there are
+# any and those of every project if not
+app.clientside_callback(
+    ClientsideFunction(namespace='map', function_name='update_markers'),
+    Output('map', 'figure'),
+    Input('map_markers', 'data'),
+    Input('marker_cache', 'data'),
+    Input('map_clusters', 'data'),
+    State('map', 'figure'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+// the marker arrays of db_map.encode_marker_arrays as plotly takes them
+function decode_markers(markers) {
+    let id = 0;
+    const ids = markers.ids.map(function (step) {
+        id += step;
+        return id;
+    });
+    const lookup = function (column) {
+        return column.codes.map(function (code) {
+            return column.values[code];
+        });
+    };
+    return {
+        ids: ids,
+        lat: markers.lat,
+        lon: markers.lon,
+        size: lookup(markers.size),
+        color: lookup(markers.color)
+    };
+}
+
+// the cluster arrays of db_map.encode_cluster_arrays as plotly takes them
+function decode_clusters(clusters) {
+    return {
+        lat: clusters.lat,
+        lon: clusters.lon,
+        customdata: clusters.count.map(function (count, i) {
+            return [count, clusters.generation[i]];
+        }),
+        size: clusters.size,
+        color: clusters.color.codes.map(function (code) {
+            return clusters.color.values[code];
+        })
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    map: {
+        // replace the marker arrays of the map traces, leaving the layout (and
+        // with it the user's camera, see uirevision) untouched
+        update_markers: function (markers, cache, clusters, figure) {
+            if (!markers && cache) {
+                markers = cache.markers;
+            }
+            let grouped = {lat: [], lon: [], customdata: [], size: [], color: []};
+            if (clusters) {
+                // zoomed out: clusters and the projects alone in their cell
+                markers = clusters.markers;
+                grouped = decode_clusters(clusters.clusters);
+            }
+            if (!markers || !figure) {
+                return window.dash_clientside.no_update;
+            }
+            markers = decode_markers(markers);
+            const trace = Object.assign({}, figure.data[0], {
+                lat: markers.lat,
+                lon: markers.lon,
+                customdata: markers.ids,
+                marker: Object.assign({}, figure.data[0].marker, {
+                    size: markers.size,
+                    color: markers.color
+                })
+            });
+            const cluster_trace = Object.assign({}, figure.data[1], {
+                lat: grouped.lat,
+                lon: grouped.lon,
+                customdata: grouped.customdata,
+                marker: Object.assign({}, figure.data[1].marker, {
+                    size: grouped.size,
+                    color: grouped.color
+                })
+            });
+            return Object.assign({}, figure, {data: [trace, cluster_trace]});
+        },
+        // the markers of every project; the renderer waits for the promise
+        load_markers: function (url) {
+            if (!url) {
+                return window.dash_clientside.no_update;
+            }
+            return fetch(url, {credentials: 'same-origin'}).then(function (response) {
+                if (!response.ok) {
+                    throw new Error('markers: HTTP ' + response.status);
+                }
+                return response.json();
+            });
+        },
+        // the pyramid level of a new zoom, null where single projects are
+        // shown; unchanged levels do not go to the server
+        zoom_level: function (relayout, level) {
+            if (!relayout || relayout['mapbox.zoom'] === undefined || !level) {
+                return window.dash_clientside.no_update;
+            }
+            const zoom = relayout['mapbox.zoom'];
+            const next = zoom < level.cluster_zoom ? Math.max(Math.floor(zoom), 0) : null;
+            if (next === level.level) {
+                return window.dash_clientside.no_update;
+            }
+            return Object.assign({}, level, {level: next});
+        }
+    }
+});
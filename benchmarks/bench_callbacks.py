@@ -0,0 +1,245 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import plotly
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# the cases clear the filter cache, which must not be that of an app running
+# on this machine
+os.environ['UIPV_APP_CACHE_DIR'] = tempfile.mkdtemp(prefix='uipvapp_bench_cache_')
+atexit.register(shutil.rmtree, os.environ['UIPV_APP_CACHE_DIR'], ignore_errors=True)
+
+import app  # noqa: E402
+import dataset  # noqa: E402
+import db_map  # noqa: E402
+import db_overview  # noqa: E402
+import filter_cache  # noqa: E402
+import images  # noqa: E402
+import map_pyramid  # noqa: E402
+import overview_selection  # noqa: E402
+from synthetic import generate_projects  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+default_sizes = [200, 10000, 100000, 1000000]
+
+
+def payload_bytes(output):
+    # the size of the callback output as Dash serialises it for the browser
+    return len(json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def clear_caches():
+    with app.server.app_context():
+        filter_cache.cache.clear()
+    images.image_cache.clear()
+    app.cluster_cache.clear()
+    overview_selection.figure_cache.clear()
+    overview_selection.cube_cache.clear()
+    db_overview._figure_cache.clear()
+
+
+def checklist_values(frame, col):
+    return [str(v) for v in frame[col].dropna().unique()]
+
+
+def unfiltered_values(frame):
+    # the filter values of a fresh map page: every box ticked, full ranges
+    return [[1945, 2030],
+            checklist_values(frame, 'Project Function Clean'),
+            checklist_values(frame, 'System Type Clean'),
+            checklist_values(frame, 'Simple System Building Element'),
+            [0, float(frame['System Coverage'].max())],
+            [0, float(frame['System Specific Yield'].max())],
+            [0, float(frame['System Generation'].max())],
+            [-180, 360],
+            checklist_values(frame, 'Module Cell Type(s)'),
+            [0, 100],
+            None]
+
+
+def filter_scenarios(frame):
+    base = unfiltered_values(frame)
+    functions = base[1][:2]
+    scenarios = {'unfiltered': base}
+    scenarios['checklist'] = base[:1] + [functions] + base[2:]
+    ranges = list(base)
+    ranges[0] = [2000, 2010]
+    ranges[6] = [0, float(frame['System Generation'].median())]
+    ranges[7] = [90, 270]
+    scenarios['ranges'] = ranges
+    search = list(base)
+    search[10] = 'facade'
+    scenarios['search'] = search
+    return scenarios
+
+
+def point(project_id):
+    return {'points': [{'customdata': int(project_id), 'bbox': {'x0': 0, 'x1': 0, 'y0': 0, 'y1': 0}}]}
+
+
+def benchmark_cases(ds, rng):
+    """(name, setup, call) triples; setup runs untimed before every call.
+
+    Cold cases start from empty caches, warm cases repeat a call whose
+    result is cached, which is what most production requests hit.
+    """
+    frame = ds.frame
+    ids = frame.index.values
+    cases = []
+    for name, values in filter_scenarios(frame).items():
+        cases.append((f'filter_data/{name}', clear_caches,
+                      lambda values=values: app.filter_map(*values, None, None)))
+    warm_values = filter_scenarios(frame)['ranges']
+    cases.append(('filter_data/ranges/warm', None,
+                  lambda: app.filter_map(*warm_values, None, None)))
+
+    cases.append(('display_hover', clear_caches,
+                  lambda: app.display_hover(point(rng.choice(ids)))))
+    cases.append(('display_hover/warm', None,
+                  lambda: app.display_hover(point(ids[0]))))
+    cases.append(('show_modal', clear_caches,
+                  lambda: app.show_modal(point(rng.choice(ids)))))
+    cases.append(('show_modal/warm', None,
+                  lambda: app.show_modal(point(ids[0]))))
+
+    # a filtered selection for the overview to follow
+    token = app.filter_map(*warm_values, None, None)[1]
+    for option in db_overview.get_overview_builders():
+        cases.append((f'update_overview_graph/{option}', clear_caches,
+                      lambda option=option: app.update_overview_graph(option, None)))
+        cases.append((f'update_overview_graph/{option}/filtered', clear_caches,
+                      lambda option=option: app.update_overview_graph(option, token)))
+        cases.append((f'update_overview_graph/{option}/warm', None,
+                      lambda option=option: app.update_overview_graph(option, None)))
+
+    for level in [0, map_pyramid.max_level]:
+        map_level = {'level': level, 'cluster_zoom': map_pyramid.cluster_zoom}
+        cases.append((f'update_clusters/{level}', clear_caches,
+                      lambda map_level=map_level: app.update_clusters(map_level, None)))
+        cases.append((f'update_clusters/{level}/filtered', clear_caches,
+                      lambda map_level=map_level: app.update_clusters(map_level, token)))
+
+    cases.append(('generate_bipv_db_map_2', None,
+                  lambda: db_map.generate_bipv_db_map_2(frame)))
+    return cases
+
+
+def run_case(setup, call, repeat, warmup=1):
+    times = []
+    with app.server.app_context():
+        for _ in range(warmup):
+            if setup is not None:
+                setup()
+            output = call()
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            output = call()
+            times.append(time.perf_counter() - started)
+    times_ms = 1000 * np.array(times)
+    return {'repeat': repeat,
+            'mean_ms': float(times_ms.mean()),
+            'min_ms': float(times_ms.min()),
+            'p50_ms': float(np.percentile(times_ms, 50)),
+            'p95_ms': float(np.percentile(times_ms, 95)),
+            'p99_ms': float(np.percentile(times_ms, 99)),
+            'max_ms': float(times_ms.max()),
+            'payload_bytes': payload_bytes(output)}
+
+
+def run(sizes, repeat, seed=0, cases=None):
+    results = []
+    source = dataset.read_display_csv()
+    for n_rows in sizes:
+        started = time.perf_counter()
+        frame = generate_projects(n_rows, seed=seed, source=source)
+        frame = frame[[c for c in frame.columns if c in dataset.app_fields]]
+        ds = dataset.ProjectDataset(frame, source='synthetic', version=f'synthetic-{n_rows}-{seed}')
+        build_ms = 1000 * (time.perf_counter() - started)
+        dataset.set_dataset(ds)
+        clear_caches()
+        results.append({'rows': n_rows, 'case': 'dataset build', 'repeat': 1, 'p50_ms': build_ms})
+        rng = np.random.default_rng(seed)
+        # fewer repeats for the large datasets keep the whole run in minutes
+        n_repeat = max(3, int(repeat * min(1, 10000 / n_rows) ** 0.5))
+        for name, setup, call in benchmark_cases(ds, rng):
+            if cases and not any(name.startswith(c) for c in cases):
+                continue
+            result = run_case(setup, call, n_repeat)
+            results.append(dict(rows=n_rows, case=name, **result))
+            logger.info("%8d rows  %-50s p50 %9.2f ms  p95 %9.2f ms  %9d bytes",
+                        n_rows, name, result['p50_ms'], result['p95_ms'], result['payload_bytes'])
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parents[1]).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    # cases whose median latency or payload grew past the tolerance
+    previous = {(r['rows'], r['case']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['rows'], result['case']))
+        if before is None:
+            continue
+        for metric in ['p50_ms', 'payload_bytes']:
+            if metric in result and before.get(metric) and result[metric] > tolerance * before[metric]:
+                regressions.append({'rows': result['rows'], 'case': result['case'], 'metric': metric,
+                                    'baseline': before[metric], 'current': result[metric]})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the Dash callbacks on synthetic datasets.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes)
+    parser.add_argument('--repeat', type=int, default=30, help='timed calls per case at 10k rows or fewer')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cases', nargs='*', help='only run cases starting with these names')
+    parser.add_argument('--out', help='write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--compare', help='baseline results JSON; exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='allowed ratio to the baseline before a case counts as a regression')
+    args = parser.parse_args()
+    # progress on stderr, without the app's own info logging
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    report = {'meta': {'commit': git_commit(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpu_count': os.cpu_count(),
+                       'seed': args.seed,
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')},
+              'results': run(args.sizes, args.repeat, seed=args.seed, cases=args.cases)}
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            report['regressions'] = compare(report['results'], json.load(fp), args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+    text = json.dumps(report, indent=1)
+    if args.out:
+        with open(args.out, 'w') as fp:
+            fp.write(text)
+    else:
+        print(text)
+    sys.exit(exit_code)
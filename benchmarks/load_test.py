@@ -0,0 +1,455 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import numpy as np
+
+PARENT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PARENT_DIR))
+
+logger = logging.getLogger(__name__)
+
+# a substring of the output of each server side callback
+callback_outputs = {'display_page': 'body_col_child.children',
+                    'filter_data': 'map_markers.data',
+                    'update_clusters': 'map_clusters.data',
+                    'display_hover': 'graph_tooltip.show',
+                    'show_modal': 'map_modal.style',
+                    'close_modal': 'map.clickData',
+                    'update_overview_graph': 'overview_graphs_target.children'}
+
+checklist_ids = ['filter_project_function',
+                 'filter_type',
+                 'filter_elements',
+                 'filter_cell_types']
+
+slider_ids = ['filter_built_year',
+              'filter_coverage',
+              'filter_specific_yield',
+              'filter_generation',
+              'filter_orientation',
+              'filter_transparency']
+
+search_terms = ['facade', 'roof', 'school', 'office', 'glass', 'museum']
+
+
+class DashClient:
+    """One browser tab: a keep-alive connection to the app, posting callback
+    requests the way the Dash renderer does."""
+
+    def __init__(self, url, dependencies, timeout=60):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.dependencies = dependencies
+        self.records = []
+        self._connection = None
+
+    def _request(self, method, path, body=None):
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            self._connection.request(method, path, body=body, headers=headers)
+            response = self._connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self._connection.close()
+            self._connection = None
+            raise
+
+    def get_json(self, path):
+        status, data = self._request('GET', path)
+        if status != 200:
+            raise RuntimeError(f'GET {path}: {status}')
+        return json.loads(data)
+
+    def fetch(self, name, path):
+        # a plain GET, recorded like the callbacks; nothing is cached here,
+        # so each fetch costs what a first visit to the map page does
+        started = time.perf_counter()
+        status, error, data = None, None, b''
+        try:
+            status, data = self._request('GET', path)
+            if status != 200:
+                error = f'HTTP {status}'
+        except Exception as e:
+            error = type(e).__name__
+        self.records.append({'callback': name,
+                             'ms': 1000 * (time.perf_counter() - started),
+                             'status': status,
+                             'error': error,
+                             'request_bytes': 0,
+                             'response_bytes': len(data)})
+        if error is not None:
+            return None
+        return json.loads(data)
+
+    def call(self, name, inputs, state=(), changed=None):
+        # inputs and state are the values in the order the callback declares them
+        dependency = self.dependencies[name]
+        output = dependency['output']
+        if output.startswith('..'):
+            outputs = [dict(zip(['id', 'property'], o.rsplit('.', 1)))
+                       for o in output[2:-2].split('...')]
+        else:
+            outputs = dict(zip(['id', 'property'], output.rsplit('.', 1)))
+        payload = {'output': output,
+                   'outputs': outputs,
+                   'inputs': [dict(d, value=v) for d, v in zip(dependency['inputs'], inputs)],
+                   'state': [dict(d, value=v) for d, v in zip(dependency['state'], state)],
+                   'changedPropIds': [f"{d['id']}.{d['property']}" for d in dependency['inputs']][:1]
+                   if changed is None else changed}
+        body = json.dumps(payload)
+        started = time.perf_counter()
+        status, error, data = None, None, b''
+        try:
+            status, data = self._request('POST', '/_dash-update-component', body)
+            if status not in (200, 204):
+                error = f'HTTP {status}'
+        except Exception as e:
+            error = type(e).__name__
+        self.records.append({'callback': name,
+                             'ms': 1000 * (time.perf_counter() - started),
+                             'status': status,
+                             'error': error,
+                             'request_bytes': len(body),
+                             'response_bytes': len(data)})
+        if error is not None or status == 204:
+            return None
+        return json.loads(data)['response']
+
+
+def find_dependencies(dependencies):
+    found = dict()
+    for name, output in callback_outputs.items():
+        matches = [d for d in dependencies if output in d['output'] and d.get('clientside_function') is None]
+        if matches:
+            found[name] = matches[0]
+    return found
+
+
+def component_props(tree, ids, found=None):
+    # the props of the components with the given ids in a serialised layout
+    if found is None:
+        found = dict()
+    if isinstance(tree, dict):
+        props = tree.get('props')
+        if isinstance(props, dict) and props.get('id') in ids:
+            found[props['id']] = props
+        for value in tree.values():
+            component_props(value, ids, found)
+    elif isinstance(tree, list):
+        for value in tree:
+            component_props(value, ids, found)
+    return found
+
+
+def marker_ids(markers):
+    # sent as differences to the previous ID, see db_map.encode_marker_arrays
+    return np.cumsum(markers['ids']).tolist()
+
+
+def update_ids(response, ids, all_ids):
+    # unchanged markers are not in the response, none mean every project
+    if 'map_markers' not in response:
+        return ids
+    if response['map_markers']['data'] is None:
+        return all_ids
+    return marker_ids(response['map_markers']['data'])
+
+
+def option_values(options):
+    return [o['value'] if isinstance(o, dict) else o for o in options]
+
+
+class MapState:
+    """The filter values of one map page, edited like a user would."""
+
+    def __init__(self, layout, rng):
+        props = component_props(layout, set(checklist_ids + slider_ids +
+                                            ['filter_input_description', 'map_level', 'marker_url']))
+        self.rng = rng
+        self.level = props.pop('map_level', dict()).get('data')
+        self.marker_url = props.pop('marker_url', dict()).get('data')
+        self.values = {i: props[i].get('value') for i in props}
+        self.options = {i: option_values(props[i].get('options', [])) for i in checklist_ids if i in props}
+        self.ranges = {i: (props[i].get('min'), props[i].get('max')) for i in slider_ids if i in props}
+
+    def toggle_checklist(self):
+        checklist = self.rng.choice(list(self.options))
+        option = self.rng.choice(self.options[checklist])
+        values = list(self.values.get(checklist) or [])
+        values = [v for v in values if v != option] if option in values else values + [option]
+        self.values[checklist] = values
+        return checklist
+
+    def drag_slider(self):
+        slider = self.rng.choice(list(self.ranges))
+        low, high = self.ranges[slider]
+        if low is None or high is None:
+            return slider
+        a, b = sorted(self.rng.uniform(low, high, 2))
+        self.values[slider] = [float(a), float(b)]
+        return slider
+
+    def search(self):
+        self.values['filter_input_description'] = str(self.rng.choice(search_terms))
+        return 'filter_input_description'
+
+    def inputs(self, dependency):
+        values = dict(self.values, map_level=self.level)
+        return [values.get(d['id']) for d in dependency['inputs']]
+
+
+def run_session(client, rng, think_s=0.0):
+    """Navigate to the map, filter, hover and open projects, then look at
+    the overview charts of the selection."""
+    def pause():
+        if think_s:
+            time.sleep(rng.exponential(think_s))
+
+    response = client.call('display_page', ['/page-map'])
+    if response is None:
+        return
+    state = MapState(response['body_col_child']['children'], rng)
+    clustered = 'update_clusters' in client.dependencies and state.level is not None
+    if clustered:
+        client.call('update_clusters', [state.level, None])
+    pause()
+
+    all_ids = []
+    if state.marker_url:
+        response = client.fetch('map_markers_url', state.marker_url)
+        if response is not None:
+            all_ids = marker_ids(response['markers'])
+    ids = all_ids
+    pause()
+
+    token = None
+    filter_dependency = client.dependencies['filter_data']
+    for _ in range(rng.integers(3, 7)):
+        edit = rng.choice([state.toggle_checklist, state.drag_slider, state.drag_slider, state.search])
+        changed = edit()
+        response = client.call('filter_data', state.inputs(filter_dependency), [token],
+                               changed=[f'{changed}.value'])
+        if response is not None:
+            # outputs left as they are are not in the response
+            token = response.get('dataframe_temp', dict(data=token))['data']
+            ids = update_ids(response, ids, all_ids)
+            if clustered:
+                client.call('update_clusters', [state.level, token])
+        pause()
+
+    # zoom in level by level until the single projects show, the markers of
+    # a filtered selection are sent with the last one
+    while clustered and state.level['level'] is not None:
+        level = state.level['level'] + 1
+        state.level = dict(state.level, level=level if level < state.level['cluster_zoom'] else None)
+        client.call('update_clusters', [state.level, token])
+        response = client.call('filter_data', state.inputs(filter_dependency), [token],
+                               changed=['map_level.data'])
+        if response is not None:
+            ids = update_ids(response, ids, all_ids)
+        pause()
+
+    for _ in range(rng.integers(5, 11)):
+        if not ids:
+            break
+        client.call('display_hover', [{'points': [{'customdata': int(rng.choice(ids)), 'bbox': {}}]}])
+        pause()
+    for _ in range(rng.integers(1, 4)):
+        if not ids:
+            break
+        client.call('show_modal', [{'points': [{'customdata': int(rng.choice(ids)), 'bbox': {}}]}])
+        pause()
+        client.call('close_modal', [1])
+
+    response = client.call('display_page', ['/page-overview'])
+    if response is None:
+        return
+    options = component_props(response, {'graph_selector'}).get('graph_selector', {}).get('options', [])
+    for option in rng.permutation(option_values(options))[:rng.integers(2, 5)]:
+        client.call('update_overview_graph', [str(option)], [token])
+        pause()
+
+
+def wait_until_up(url, server=None, timeout=120):
+    parts = urlsplit(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f'the server exited with {server.returncode}')
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            connection.request('GET', '/_dash-layout')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'{url} did not come up within {timeout} s')
+
+
+def start_gunicorn(workers, threads, port, data_path=None):
+    env = dict(os.environ)
+    if data_path:
+        env['UIPV_APP_DATA_PATH'] = data_path
+    command = [sys.executable, '-m', 'gunicorn', 'app:server',
+               '--workers', str(workers), '--threads', str(threads),
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    return subprocess.Popen(command, cwd=PARENT_DIR, env=env)
+
+
+def summarise(records, elapsed_s, n_sessions):
+    callbacks = dict()
+    for name in sorted({r['callback'] for r in records}):
+        rows = [r for r in records if r['callback'] == name]
+        ok_ms = np.array([r['ms'] for r in rows if r['error'] is None])
+        errors = sum(r['error'] is not None for r in rows)
+        callbacks[name] = {'count': len(rows),
+                           'errors': errors,
+                           'error_rate': errors / len(rows),
+                           'p50_ms': float(np.percentile(ok_ms, 50)) if len(ok_ms) else None,
+                           'p95_ms': float(np.percentile(ok_ms, 95)) if len(ok_ms) else None,
+                           'p99_ms': float(np.percentile(ok_ms, 99)) if len(ok_ms) else None,
+                           'mean_request_bytes': float(np.mean([r['request_bytes'] for r in rows])),
+                           'mean_response_bytes': float(np.mean([r['response_bytes'] for r in rows]))}
+    errors = sum(r['error'] is not None for r in records)
+    all_ms = np.array([r['ms'] for r in records if r['error'] is None])
+    return {'requests': len(records),
+            'sessions': n_sessions,
+            'duration_s': elapsed_s,
+            'throughput_rps': len(records) / elapsed_s if elapsed_s else None,
+            'sessions_per_s': n_sessions / elapsed_s if elapsed_s else None,
+            'errors': errors,
+            'error_rate': errors / len(records) if records else None,
+            'p50_ms': float(np.percentile(all_ms, 50)) if len(all_ms) else None,
+            'p95_ms': float(np.percentile(all_ms, 95)) if len(all_ms) else None,
+            'p99_ms': float(np.percentile(all_ms, 99)) if len(all_ms) else None,
+            'callbacks': callbacks}
+
+
+def run_load(url, concurrency, sessions=None, duration=None, think_s=0.0, seed=0):
+    """Run sessions from concurrency simultaneous users until the number of
+    sessions or the duration is reached, whichever comes first."""
+    probe = DashClient(url, dict())
+    dependencies = find_dependencies(probe.get_json('/_dash-dependencies'))
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+    lock = threading.Lock()
+    counter = {'started': 0, 'finished': 0}
+    records = []
+
+    def user(index):
+        rng = np.random.default_rng([seed, index])
+        client = DashClient(url, dependencies)
+        while True:
+            with lock:
+                if sessions is not None and counter['started'] >= sessions:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                counter['started'] += 1
+            try:
+                run_session(client, rng, think_s)
+            except Exception:
+                logger.exception('session failed')
+            with lock:
+                counter['finished'] += 1
+        with lock:
+            records.extend(client.records)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(user, range(concurrency)))
+    return summarise(records, time.perf_counter() - started, counter['finished'])
+
+
+def print_summary(summary, out=sys.stderr):
+    print(f"{summary['requests']} requests in {summary['duration_s']:.1f} s: "
+          f"{summary['throughput_rps']:.1f} req/s, {summary['sessions']} sessions, "
+          f"{100 * (summary['error_rate'] or 0):.2f}% errors", file=out)
+    for name, c in summary['callbacks'].items():
+        print(f"  {name:24s} {c['count']:6d}  p50 {c['p50_ms'] or 0:8.1f}  p95 {c['p95_ms'] or 0:8.1f}"
+              f"  p99 {c['p99_ms'] or 0:8.1f} ms  {100 * c['error_rate']:5.1f}% errors"
+              f"  {c['mean_response_bytes'] / 1024:8.1f} KB", file=out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay user sessions against the Dash callback endpoint.')
+    parser.add_argument('--url', help='a running app; by default gunicorn is started locally')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='gunicorn worker counts, one run each')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=8051)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4],
+                        help='simultaneous users, one run each')
+    parser.add_argument('--sessions', type=int, help='sessions per run (default: 20 per user)')
+    parser.add_argument('--duration', type=float, help='seconds per run, instead of a session count')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='mean pause between requests')
+    parser.add_argument('--rows', type=int, help='serve a synthetic dataset of this many projects')
+    parser.add_argument('--data', help='serve this display dataset (.csv or .npz)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    data_path = args.data
+    if args.rows and not args.url:
+        from synthetic import generate_projects
+        import columnar
+        data_path = os.path.join(tempfile.mkdtemp(), f'synthetic_{args.rows}.npz')
+        columnar.write_columnar(generate_projects(args.rows, seed=args.seed), data_path,
+                                metadata={'source_version': f'synthetic-{args.rows}-{args.seed}'})
+
+    runs = []
+    for workers in ([None] if args.url else args.workers):
+        server = None
+        url = args.url
+        if url is None:
+            url = f'http://127.0.0.1:{args.port}'
+            server = start_gunicorn(workers, args.threads, args.port, data_path)
+        try:
+            wait_until_up(url, server)
+            for concurrency in args.concurrency:
+                sessions = args.sessions
+                if sessions is None and args.duration is None:
+                    sessions = 20 * concurrency
+                summary = run_load(url, concurrency, sessions, args.duration,
+                                   args.think_ms / 1000, args.seed)
+                logger.info("workers %s, concurrency %d", workers, concurrency)
+                print_summary(summary)
+                runs.append(dict({'workers': workers, 'threads': args.threads,
+                                  'concurrency': concurrency}, **summary))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = {'meta': {'url': args.url,
+                       'rows': args.rows,
+                       'data': args.data,
+                       'think_ms': args.think_ms,
+                       'seed': args.seed,
+                       'python': platform.python_version(),
+                       'cpu_count': os.cpu_count(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')},
+              'runs': runs}
+    text = json.dumps(report, indent=1)
+    if args.out:
+        with open(args.out, 'w') as fp:
+            fp.write(text)
+    else:
+        print(text)
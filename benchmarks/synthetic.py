@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import columnar  # noqa: E402
+import dataset  # noqa: E402
+import display_etl  # noqa: E402
+
+# columns scaled together, so that yields and marker sizes stay consistent
+scaled_fields = ['System Rating',
+                 'System Coverage',
+                 'System Generation Measured',
+                 'System Generation Simulated',
+                 'System Generation']
+
+
+def generate_projects(n_rows, seed=0, source=None):
+    """A display dataset of n_rows synthetic projects.
+
+    Rows are drawn with replacement from the real display dataset, so every
+    column keeps its dtype, labels and joint distribution; the locations are
+    jittered and each system is scaled by a random factor so that the
+    numeric filters see continuous values rather than repeats.
+    """
+    rng = np.random.default_rng(seed)
+    real = dataset.read_display_csv() if source is None else source
+    data = real.iloc[rng.integers(0, len(real), n_rows)].copy()
+    data.index = pd.RangeIndex(n_rows, name=real.index.name)
+
+    lat = data['Project Latitude'].values + rng.normal(0, 0.5, n_rows)
+    lon = data['Project Longitude'].values + rng.normal(0, 0.5, n_rows)
+    data['Project Latitude'] = np.clip(lat, -85, 85).astype(np.float32)
+    data['Project Longitude'] = (((lon + 180) % 360) - 180).astype(np.float32)
+
+    scale = rng.lognormal(0, 0.5, n_rows)
+    for col in scaled_fields:
+        data[col] = (data[col].values * scale).astype(data[col].dtype)
+    data['Map Sizes'] = pd.cut(data['System Rating'], display_etl.rating_bins,
+                               labels=display_etl.rating_sizes).astype(float) \
+        .fillna(display_etl.rating_sizes[0]).astype(int).values
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic display dataset.')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('out', help='.csv or .npz file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    projects = generate_projects(args.rows, seed=args.seed)
+    if args.out.endswith('.npz'):
+        columnar.write_columnar(projects, args.out, metadata={'source_version': f'synthetic-{args.rows}-{args.seed}'})
+    else:
+        projects.to_csv(args.out, index_label='Unnamed: 0')
+    print(f"{args.out}: {len(projects)} rows, {os.path.getsize(args.out) / 1024 ** 2:.1f} MB")
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+
+class BitmapIndex:
+    """Packed bit arrays for every value of the categorical filter columns.
+
+    Bit i of a value's bitmap is set when row i (by position) holds that
+    value. A checklist filter is the OR of its selected values and several
+    filters combine with AND, all on the packed arrays, so rows are only
+    materialised once the final selection is known.
+    """
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.n_bytes = (n_rows + 7) // 8
+        self.bitmaps = dict()
+
+    @classmethod
+    def build(cls, df, cols):
+        index = cls(len(df))
+        for col in cols:
+            index.add_column(col, df[col])
+        return index
+
+    def add_column(self, col, series):
+        codes, uniques = pd.factorize(series, sort=False)
+        column_bitmaps = dict()
+        for code, value in enumerate(uniques):
+            column_bitmaps[value] = np.packbits(codes == code)
+        self.bitmaps[col] = column_bitmaps
+
+    def all_rows(self):
+        return np.packbits(np.ones(self.n_rows, dtype=bool))
+
+    def no_rows(self):
+        return np.zeros(self.n_bytes, dtype=np.uint8)
+
+    def match(self, col, elements):
+        column_bitmaps = self.bitmaps[col]
+        bits = self.no_rows()
+        for element in elements:
+            if element in column_bitmaps:
+                np.bitwise_or(bits, column_bitmaps[element], out=bits)
+        return bits
+
+    def match_all(self, selections, bits=None):
+        if bits is None:
+            bits = self.all_rows()
+        for col, elements in selections.items():
+            if elements is None:
+                continue
+            np.bitwise_and(bits, self.match(col, elements), out=bits)
+        return bits
+
+    def to_mask(self, bits):
+        return np.unpackbits(bits, count=self.n_rows).astype(bool)
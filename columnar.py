@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# version of the layout below, bumped whenever it changes
+format_version = 1
+
+
+# separates the strings of a text column, which can never contain it
+separator = '\x00'
+
+
+def _encode_strings(values):
+    # the strings joined into one utf-8 buffer, with a mask of the missing values
+    missing = np.asarray(pd.isna(values), dtype=bool)
+    strings = ['' if m else str(v) for v, m in zip(values, missing)]
+    text = separator.join(strings)
+    if text.count(separator) != max(len(strings) - 1, 0):
+        raise ValueError('text columns cannot contain NUL characters')
+    return np.frombuffer(text.encode('utf-8'), dtype=np.uint8), missing
+
+
+def _decode_strings(data, missing):
+    values = np.empty(len(missing), dtype=object)
+    if len(missing):
+        values[:] = data.tobytes().decode('utf-8').split(separator)
+    values[missing] = np.nan
+    return values
+
+
+def _column_arrays(key, series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        if categories.dtype == object:
+            data, missing = _encode_strings(categories.values)
+            arrays = {f'{key}_cat_data': data,
+                      f'{key}_cat_missing': missing}
+        else:
+            arrays = {f'{key}_cat_values': categories.values}
+        arrays[f'{key}_codes'] = series.cat.codes.values
+        return 'category', arrays
+    if series.dtype == object:
+        data, missing = _encode_strings(series.values)
+        return 'string', {f'{key}_data': data,
+                          f'{key}_missing': missing}
+    return 'values', {f'{key}_values': series.values}
+
+
+def write_columnar(df, path, metadata=None):
+    """Write the frame as an uncompressed .npz with a few arrays per column.
+
+    Numbers keep their dtype, categoricals are stored as codes and
+    categories, and text as one NUL separated utf-8 buffer, so reading a
+    column never involves type inference and needs no pickling.
+    """
+    arrays = {'index_values': df.index.values}
+    columns = []
+    for i, col in enumerate(df.columns):
+        kind, column_arrays = _column_arrays(f'c{i}', df[col])
+        arrays.update(column_arrays)
+        columns.append({'name': col, 'key': f'c{i}', 'kind': kind})
+    meta = {'format_version': format_version,
+            'index_name': df.index.name,
+            'columns': columns,
+            'metadata': metadata or dict()}
+    arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+    with open(path, 'wb') as fp:
+        np.savez(fp, **arrays)
+
+
+def _read_meta(npz):
+    return json.loads(npz['meta'].tobytes().decode('utf-8'))
+
+
+def read_columnar_meta(path):
+    with np.load(path, allow_pickle=False) as npz:
+        return _read_meta(npz)
+
+
+def _read_column(npz, key, kind):
+    if kind == 'category':
+        if f'{key}_cat_values' in npz.files:
+            categories = npz[f'{key}_cat_values']
+        else:
+            categories = _decode_strings(npz[f'{key}_cat_data'], npz[f'{key}_cat_missing'])
+        return pd.Categorical.from_codes(npz[f'{key}_codes'], categories=categories)
+    if kind == 'string':
+        return _decode_strings(npz[f'{key}_data'], npz[f'{key}_missing'])
+    return npz[f'{key}_values']
+
+
+def read_columnar(path, cols=None):
+    """Read a frame written by write_columnar.
+
+    Only the arrays of the requested columns are read from the file. Names
+    that are not columns, such as the index of the csv, are ignored, so the
+    same list can be passed as the usecols of read_csv.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        meta = _read_meta(npz)
+        columns = meta['columns']
+        if cols is not None:
+            wanted = set(cols)
+            columns = [c for c in columns if c['name'] in wanted]
+        index = pd.Index(npz['index_values'], name=meta['index_name'])
+        data = {c['name']: _read_column(npz, c['key'], c['kind']) for c in columns}
+    return pd.DataFrame(data, index=index, columns=[c['name'] for c in columns])
@@ -0,0 +1,241 @@
+import argparse
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import columnar
+import utils
+from bitmap_index import BitmapIndex
+from map_pyramid import MapPyramid
+from rollup_cube import RollupCube
+from search_index import SearchIndex
+
+PARENT_DIR = Path(__file__).parent.resolve()
+assets_dir = os.path.join(PARENT_DIR, 'assets')
+display_csv = os.path.join(assets_dir, 'database_display.csv')
+display_npz = os.path.join(assets_dir, 'database_display.npz')
+
+# another display dataset (.csv or .npz) to serve instead, e.g. a synthetic one
+data_path = os.getenv('UIPV_APP_DATA_PATH')
+
+logger = logging.getLogger(__name__)
+
+# the columns read by the app, the rest of the display csv is never loaded
+app_fields = ['Unnamed: 0',
+              'Project Name',
+              'Project Type',
+              'Project Plant Year',
+              'Project Built Year',
+              'Project Country',
+              'Project Latitude',
+              'Project Longitude',
+              'Project Function',
+              'Project Description',
+              'Project Link',
+              'System Rating',
+              'System Coverage',
+              'System Specific Yield',
+              'System Generation Measured',
+              'System Generation Simulated',
+              'Array Surface(s)',
+              'Array Tilt(s)',
+              'Module Cell Type(s)',
+              'Module Transparency',
+              'Image Name',
+              'Simple System Building Element',
+              'System Type Clean',
+              'Map Symbols2',
+              'Project Function Clean',
+              'Array Orientation(s) Clean',
+              'Map Sizes',
+              'System Generation',
+              'Map Colors']
+
+# low cardinality labels used by the checklists, legends and overview charts
+category_fields = ['Project Type',
+                   'Project Function Clean',
+                   'System Type Clean',
+                   'Simple System Building Element',
+                   'Array Orientation(s) Clean',
+                   'Module Cell Type(s)',
+                   'Map Colors',
+                   'Map Symbols2']
+
+# columns filtered by the map checklists, indexed as bitmaps at load
+checklist_fields = ['Project Function Clean',
+                    'System Type Clean',
+                    'Simple System Building Element',
+                    'Module Cell Type(s)']
+
+# free text matched by the 'Search Text' filter
+search_fields = ['Project Name',
+                 'Project Description']
+
+# numbers mixed with text labels, split into values and a label mask at load
+mixed_type_fields = ['Project Built Year',
+                     'Array Orientation(s) Clean']
+
+# mixed type columns holding compass angles, normalised to [0, 360)
+angle_fields = ['Array Orientation(s) Clean']
+
+float_fields = ['Project Latitude',
+                'Project Longitude',
+                'System Rating',
+                'System Coverage',
+                'System Specific Yield',
+                'System Generation Measured',
+                'System Generation Simulated',
+                'System Generation']
+
+
+def get_dtypes():
+    dtypes = {col: 'category' for col in category_fields}
+    dtypes.update({col: 'float32' for col in float_fields})
+    return dtypes
+
+
+def file_version(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def read_display_csv(path=display_csv, cols=None):
+    if cols is None:
+        dtypes = get_dtypes()
+    else:
+        dtypes = {k: v for k, v in get_dtypes().items() if k in cols}
+    data = pd.read_csv(path,
+                       index_col="Unnamed: 0",
+                       usecols=cols,
+                       dtype=dtypes)
+    # the unnamed first column is the stable project ID used by the map points
+    data.index.name = 'Project ID'
+    return data
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def convert_display_csv(csv_path=display_csv, npz_path=display_npz):
+    # every column is kept, projection happens when the file is read
+    data = read_display_csv(csv_path)
+    columnar.write_columnar(data, npz_path, metadata={'source_version': file_version(csv_path),
+                                                      **file_stat(csv_path)})
+    return data
+
+
+def load_display_frame(cols=app_fields, csv_path=display_csv, npz_path=display_npz):
+    """The display dataset and its version, read from the columnar file
+    when it was converted from the current csv, and from the csv otherwise.
+
+    The csv is only hashed when its size or modification time differ from
+    those recorded at the conversion, e.g. after a fresh checkout.
+    """
+    csv_exists = os.path.exists(csv_path)
+    version = None
+    if os.path.exists(npz_path):
+        meta = columnar.read_columnar_meta(npz_path)
+        metadata = meta['metadata']
+        source_version = metadata.get('source_version')
+        if meta['format_version'] == columnar.format_version:
+            if not csv_exists or all(metadata.get(k) == v for k, v in file_stat(csv_path).items()):
+                return columnar.read_columnar(npz_path, cols), source_version
+            version = file_version(csv_path)
+            if version == source_version:
+                return columnar.read_columnar(npz_path, cols), source_version
+        logger.warning("%s is out of date, loading %s; run `python dataset.py` to convert it",
+                       npz_path, csv_path)
+    if version is None and csv_exists:
+        version = file_version(csv_path)
+    return read_display_csv(csv_path, cols), version
+
+
+def load_data_file(path, cols=app_fields):
+    if path.endswith('.npz'):
+        source_version = columnar.read_columnar_meta(path)['metadata'].get('source_version')
+        return columnar.read_columnar(path, cols), source_version or file_version(path)
+    return read_display_csv(path, cols), file_version(path)
+
+
+class ProjectDataset:
+    """The project database as loaded once per worker process.
+
+    The frame is shared by every callback in the process, so it must be
+    treated as read-only: select or copy before changing anything.
+    """
+
+    def __init__(self, frame, source=None, version=None):
+        self._frame = frame
+        self.source = source
+        self.version = version
+        self.bitmaps = BitmapIndex.build(frame, checklist_fields)
+        self.search = SearchIndex.build(frame, search_fields)
+        self.cube = RollupCube.build(frame)
+        self.pyramid = MapPyramid.build(frame)
+        self.mixed = dict()
+        for col in mixed_type_fields:
+            values, is_label = utils.split_mixed_type(frame[col])
+            if col in angle_fields:
+                values = np.mod(values, 360)
+            self.mixed[col] = (values, is_label)
+
+    @property
+    def frame(self):
+        return self._frame
+
+    def __len__(self):
+        return len(self._frame)
+
+    def select(self, cols=None):
+        if cols is None:
+            return self._frame
+        return self._frame[cols]
+
+    def project(self, project_id):
+        # hash lookup on the unique project ID index
+        return self._frame.loc[project_id]
+
+
+_dataset = None
+_dataset_lock = threading.Lock()
+
+
+def get_dataset():
+    global _dataset
+    if _dataset is None:
+        with _dataset_lock:
+            if _dataset is None:
+                if data_path:
+                    frame, version = load_data_file(data_path)
+                    _dataset = ProjectDataset(frame, source=data_path, version=version)
+                else:
+                    frame, version = load_display_frame()
+                    _dataset = ProjectDataset(frame, source=display_csv, version=version)
+    return _dataset
+
+
+def set_dataset(ds):
+    # replaces the dataset of this process, e.g. with a synthetic one
+    global _dataset
+    with _dataset_lock:
+        _dataset = ds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the display csv to the columnar file loaded by the app.')
+    parser.add_argument('--csv', default=display_csv)
+    parser.add_argument('--out', default=display_npz)
+    args = parser.parse_args()
+    converted = convert_display_csv(args.csv, args.out)
+    print(f"{args.out}: {len(converted)} rows, {len(converted.columns)} columns, "
+          f"{os.path.getsize(args.out) / 1024:.0f} KB")
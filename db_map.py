@@ -1,7 +1,10 @@
 import itertools
 import os
 import dash_bootstrap_components as dbc
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
+import plotly.io as pio
 from dash import html
 
 import utils
@@ -85,7 +88,7 @@ def map_table(data, columns, header, col_list, div_id):
         title = [html.Tr(html.Td(tup[0], colSpan=2), className="modal_table_break")]
         content = [html.Tr([html.Td(col,
                                     className="table_col_a"),
-                            html.Td(df[col],
+                            html.Td(utils.display_value(df[col]),
                                     className="table_col_b")],
                            className="modal_table_row") for col in tup[1]]
         set.append(title + content)
@@ -148,24 +151,107 @@ def split_dataframe(df):
     return df_list
 
 
-def generate_bipv_db_map_2(data, lat=40, lon=145, autosize=True, zoom=None):
-    plot_data = data.copy()
+def map_marker_arrays(data):
+    # the per point arrays of the map trace, sent alone when the filters change
+    return {'ids': data.index.tolist(),
+            'lat': data['Project Latitude'].tolist(),
+            'lon': data['Project Longitude'].tolist(),
+            'size': data['Map Sizes'].tolist(),
+            'color': data['Map Colors'].tolist()}
+
+
+# decimal places of the coordinates sent to the browser, about 10 m
+coordinate_decimals = 4
+
+
+def encode_category(values):
+    # codes into the sorted list of distinct values
+    codes, uniques = pd.factorize(values, sort=True)
+    return {'codes': codes.tolist(), 'values': uniques.tolist()}
+
+
+def encode_marker_arrays(data):
+    """The marker arrays in the compact form sent to the browser.
+
+    IDs are sent as the difference to the previous ID, which is small for
+    rows in dataset order, sizes and colours as codes into their distinct
+    values, and coordinates rounded. decode_markers in assets/js_scripts.js
+    turns this back into the arrays of map_marker_arrays.
+    """
+    ids = data.index.values.astype(np.int64)
+    return {'ids': np.diff(ids, prepend=0).tolist(),
+            'lat': data['Project Latitude'].astype(float).round(coordinate_decimals).tolist(),
+            'lon': data['Project Longitude'].astype(float).round(coordinate_decimals).tolist(),
+            'size': encode_category(data['Map Sizes']),
+            'color': encode_category(data['Map Colors'])}
+
+
+def cluster_sizes(counts):
+    # marker size of a cluster, growing with the log of its project count
+    return np.minimum(12 + 4 * np.log2(counts), 40).round().astype(int)
+
+
+def encode_cluster_arrays(data, cells):
+    """The cells of a map pyramid level for the browser.
+
+    Cells with more than one project are drawn as clusters, in the colour
+    of the larger of their retrofit and new build shares, and the projects
+    alone in their cell as usual, so they can still be hovered and opened.
+    """
+    clustered = cells['count'] > 1
+    counts = cells['count'][clustered]
+    colors = utils.get_color_dict()
+    dominant = np.where(cells['retrofit'][clustered] > counts / 2, colors['retrofit_cat'], colors['new_cat'])
+    singles = data.iloc[np.sort(cells['first'][~clustered])]
+    return {'clusters': {'lat': np.round(cells['lat'][clustered] / counts, coordinate_decimals).tolist(),
+                         'lon': np.round(cells['lon'][clustered] / counts, coordinate_decimals).tolist(),
+                         'count': counts.tolist(),
+                         'generation': np.round(cells['generation'][clustered]).tolist(),
+                         'size': cluster_sizes(counts).tolist(),
+                         'color': encode_category(dominant)},
+            'markers': encode_marker_arrays(singles)}
+
+
+def empty_marker_arrays():
+    return {'ids': [], 'lat': [], 'lon': [], 'size': [], 'color': []}
+
+
+def generate_bipv_db_map_2(data=None, lat=40, lon=145, autosize=True, zoom=None):
+    # without data the figure has no points, they are filled in by the browser
+    markers = empty_marker_arrays() if data is None else map_marker_arrays(data)
 
     fig = go.Figure(
         go.Scattermapbox(
-            lat=plot_data['Project Latitude'],
-            lon=plot_data['Project Longitude'],
+            lat=markers['lat'],
+            lon=markers['lon'],
+            customdata=markers['ids'],  # project ID, resolved by the hover and click callbacks
             mode='markers',
             marker=go.scattermapbox.Marker(
                 # symbol=plot_data['Map Symbols'],
-                size=plot_data['Map Sizes'],
-                color=plot_data['Map Colors'],
+                size=markers['size'],
+                color=markers['color'],
                 allowoverlap=True,
                 opacity=0.5,
             ),
             hoverinfo='none',
         ),
     )
+    # the clusters of the zoomed out map, [count, generation] as customdata
+    fig.add_trace(
+        go.Scattermapbox(
+            lat=[],
+            lon=[],
+            customdata=[],
+            mode='markers',
+            marker=go.scattermapbox.Marker(
+                size=[],
+                color=[],
+                allowoverlap=True,
+                opacity=0.7,
+            ),
+            hoverinfo='none',
+        ),
+    )
 
     # fig = go.Figure()
     # for df_group in split_dataframe(plot_data):
@@ -191,6 +277,10 @@ def generate_bipv_db_map_2(data, lat=40, lon=145, autosize=True, zoom=None):
         autosize=autosize,
         margin=dict(l=0, r=0, t=0, b=0),
         hovermode='closest',
+        showlegend=False,
+        uirevision='map',  # keep the user's camera when the markers are replaced
+        # the trace defaults of the full template do not apply to the map
+        template=go.layout.Template(layout=pio.templates['plotly'].layout),
         mapbox=dict(
             accesstoken=mapbox_access_token,
             bearing=0,
@@ -351,7 +441,7 @@ def choose_popover_content(filter_field, data_intitial):
 
     elif filter_field == 'System Coverage':
         click_content = utils.add_range_slider(0,
-                                               data_intitial['System Coverage'].max(),
+                                               float(data_intitial['System Coverage'].max()),
                                                "filter_coverage",
                                                marks=True)
         hover_content = html.Div(f"Click '{filter_name}' and use the slider"
@@ -361,7 +451,7 @@ def choose_popover_content(filter_field, data_intitial):
 
     elif filter_field == 'System Specific Yield Calculated':
         click_content = utils.add_range_slider(0,
-                                               data_intitial['System Specific Yield'].max(),
+                                               float(data_intitial['System Specific Yield'].max()),
                                                "filter_specific_yield",
                                                marks=True)
         hover_content = html.Div(f"Click '{filter_name}' and use the slider"
@@ -372,7 +462,7 @@ def choose_popover_content(filter_field, data_intitial):
 
     elif filter_field == 'System Generation':
         click_content = utils.add_range_slider(0,
-                                               data_intitial['System Generation'].max(),
+                                               float(data_intitial['System Generation'].max()),
                                                "filter_generation",
                                                marks=True)
         hover_content = html.Div(f"Click '{filter_name}' and use the slider"
@@ -384,8 +474,9 @@ def choose_popover_content(filter_field, data_intitial):
         click_content = utils.add_compass_slider("filter_orientation")
         hover_content = html.Div(f"Click '{filter_name}' and use the slider"
                                  f" to select a range of orientation angles"
-                                 f" to filter the projects on the map. Roof"
-                                 f" and mixed systems will not be filtered.",
+                                 f" to filter the projects on the map. Start"
+                                 f" left of North to select a range across it."
+                                 f" Roof and mixed systems will not be filtered.",
                                  className='filter_hover_content')
 
     elif filter_field == 'Module Cell Type(s)':
@@ -411,8 +502,8 @@ def choose_popover_content(filter_field, data_intitial):
         click_content = utils.add_filter_input('filter_input_description')
         hover_content = html.Div(f"Click '{filter_name}' and input some text"
                                  f" to search the project descriptions and titles."
-                                 f" The search is currently simple looks to match"
-                                 f" single words, phrases, and partial words.",
+                                 f" Projects containing every word you type are"
+                                 f" shown, partial words included.",
                                  className='filter_hover_content')
 
     else:
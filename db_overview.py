@@ -1,33 +1,25 @@
+import json
+import threading
+
 import plotly.graph_objects as go
-import pandas as pd
 import numpy as np
 import time
 from utils import get_color_dict as colors
-from utils import is_retrofit
-
-
-def make_projects_by_year(data):
-    plot_data = data[['Project Built Year', 'Project Plant Year']].dropna().copy()
+from utils import project_types
 
-    plot_data['Project Type'] = plot_data.apply(lambda x: is_retrofit(x['Project Built Year'], x['Project Plant Year']),
-                                                axis=1)
-    new_build_data = plot_data[plot_data['Project Type'] == 'New Build']['Project Plant Year'].astype(int)
-    retrofit_data = plot_data[plot_data['Project Type'] == 'Retrofit']['Project Plant Year'].astype(int)
-    years = np.arange(plot_data['Project Plant Year'].min(), time.localtime().tm_year)
 
-    years_df = pd.DataFrame(pd.Series(years).astype(int).rename('index'))
-    new = new_build_data.value_counts().reset_index().set_index('index').rename(
-        columns={'Project Plant Year': 'newbuild'})
-    retro = retrofit_data.value_counts().reset_index().set_index('index').rename(
-        columns={'Project Plant Year': 'retrofit'})
+def make_projects_by_year(cube):
+    # answered from the rollup cube: plant year x project type counts
+    counts = cube.rollup(['Project Plant Year', 'Project Type'], measures=[])
+    counts = counts.pivot(index='Project Plant Year', columns='Project Type', values='count')
 
-    years_df = years_df.set_index('index').join(new)
-    years_df = years_df.join(retro).fillna(0)
-    years_df = years_df.astype(int)
+    first_year = counts.index.min() if len(counts) else time.localtime().tm_year
+    years = np.arange(first_year, time.localtime().tm_year).astype(int)
+    counts = counts.reindex(index=years, columns=['New Build', 'Retrofit']).fillna(0).astype(int)
 
-    years = years_df.index.tolist()
-    newbuild = years_df.newbuild.tolist()
-    retro = years_df.retrofit.tolist()
+    years = years.tolist()
+    newbuild = counts['New Build'].tolist()
+    retro = counts['Retrofit'].tolist()
 
     fig = go.Figure(data=[
         go.Bar(name='New Construction', x=years, y=newbuild,
@@ -66,25 +58,21 @@ def make_projects_by_year(data):
 
 
 def make_projects_by_generation_capacity(data):
-    plot_data = data.copy()
-    plot_data['Project Type'] = plot_data.apply(lambda x: is_retrofit(x['Project Built Year'], x['Project Plant Year']),
-                                                axis=1)
-    plot_data.dropna(subset=['Project Function', 'System Rating', 'System Specific Yield'], inplace=True)
-    plot_data['System Specific Yield'] = plot_data['System Specific Yield'].astype(float)
-    plot_data = plot_data[plot_data['System Specific Yield'] != 0]
-    plot_data['System Generation Measured'].fillna(0, inplace=True)
-    plot_data['System Generation Simulated'].fillna(0, inplace=True)
-    plot_data['System Generation'] = plot_data[
-        ['System Generation Measured', 'System Generation Simulated']].values.max(1)
-
-    new = plot_data[plot_data['Project Type'] == 'New Build']
-    retro = plot_data[plot_data['Project Type'] == 'Retrofit']
-
-    x_new = new['System Rating']
-    y_new = new['System Generation']
-
-    x_retro = retro['System Rating']
-    y_retro = retro['System Generation']
+    plot_data = data[['Project Function', 'Project Built Year', 'Project Plant Year',
+                      'System Rating', 'System Specific Yield',
+                      'System Generation Measured', 'System Generation Simulated']]
+    plot_data = plot_data.dropna(subset=['Project Function', 'System Rating', 'System Specific Yield'])
+    plot_data = plot_data[plot_data['System Specific Yield'].values.astype(float) != 0]
+    is_new = project_types(plot_data['Project Built Year'], plot_data['Project Plant Year']) == 'New Build'
+    rating = plot_data['System Rating'].values
+    generation = np.fmax(plot_data['System Generation Measured'].fillna(0).values,
+                         plot_data['System Generation Simulated'].fillna(0).values)
+
+    x_new = rating[is_new]
+    y_new = generation[is_new]
+
+    x_retro = rating[~is_new]
+    y_retro = generation[~is_new]
 
     fig = go.Figure(data=[
         go.Scatter(name='New Build', x=x_new, y=y_new, mode='markers',
@@ -121,9 +109,6 @@ def make_projects_by_generation_capacity(data):
 def make_projects_by_coverage_yield(data):
     plot_data = data[(data['System Coverage'] > 0) & (data['System Specific Yield'] > 0)]
 
-    new = plot_data[plot_data['Project Type'] == 'New Build']
-    retro = plot_data[plot_data['Project Type'] == 'Retrofit']
-
     shape_map = {'Facade': "triangle-right",
                  'Roof': "triangle-up",
                  'Mixed': "cross",
@@ -132,12 +117,18 @@ def make_projects_by_coverage_yield(data):
                  'Canopy': "star-square",
                  'None': "circle",
                  'Unknown': "circle"}
+    # row positions of every surface type from a single grouping pass
+    surfaces = plot_data['Simple System Building Element']
+    groups = surfaces.groupby(surfaces.values, sort=False).indices
+    coverage = plot_data['System Coverage'].values
+    specific_yield = plot_data['System Specific Yield'].values
+
     scatter_traces = []
-    for surface in plot_data['Simple System Building Element'].unique():
-        trace_data = plot_data[plot_data['Simple System Building Element'] == surface]
+    for surface in surfaces.unique():
+        rows = groups[surface]
         trace = go.Scatter(name=surface,
-                           x=trace_data['System Coverage'],
-                           y=trace_data['System Specific Yield'],
+                           x=coverage[rows],
+                           y=specific_yield[rows],
                            mode='markers',
                            marker_symbol=shape_map[surface],
                            # marker_color=
@@ -170,25 +161,22 @@ def make_projects_by_coverage_yield(data):
     )
     return fig
 
-def make_surface_type_plot(data):
-    plot_data = data.copy()
+def make_surface_type_plot(cube):
 
     elements = ['Facade', 'Roof', 'Canopy', 'Unknown', 'Glazed', 'Shading', 'Mixed']
     color_list = ["#264653", "#287271", "#2a9d8f", "#8ab17d", "#e9c46a", "#f4a261", "#ee8959", "#e76f51"]
     color_map = dict(zip(elements,color_list))
 
-    scatter_traces = []
-    for surface in plot_data['Simple System Building Element'].unique():
+    # answered from the rollup cube: surface x year counts
+    counts = cube.rollup(['Simple System Building Element', 'Project Plant Year'], measures=[])
 
-        trace_data = plot_data[plot_data['Simple System Building Element'] == surface]
-        trace_data = pd.DataFrame(trace_data['Project Plant Year'].value_counts()).reset_index().rename(
-            columns={'index': 'Plant Year',
-                     'Project Plant Year': 'Count'})
-        trace_data = trace_data.sort_values(by='Plant Year')
+    scatter_traces = []
+    for surface, trace_data in counts.groupby('Simple System Building Element', sort=False):
+        trace_data = trace_data.sort_values(by='Project Plant Year')
         trace = go.Scatter(
             name=surface,
-            x=trace_data['Plant Year'],
-            y=trace_data['Count'],
+            x=trace_data['Project Plant Year'].values.astype(int),
+            y=trace_data['count'].values,
             hoverinfo='x+y',
             mode='lines',
             line=dict(width=0.5, color=color_map[surface]),
@@ -222,4 +210,40 @@ def make_surface_type_plot(data):
             x=1.01
         )
     )
-    return fig
\ No newline at end of file
+    return fig
+
+
+def get_overview_builders():
+    return {'Year and Type': make_projects_by_year,
+            'Generation and Capacity': make_projects_by_generation_capacity,
+            'Surface Area and Yield': make_projects_by_coverage_yield,
+            'Surface Type': make_surface_type_plot}
+
+
+# charts answered from the rollup cube rather than the project rows
+cube_charts = ['Year and Type', 'Surface Type']
+
+
+def build_overview_figure(option, frame, cube):
+    builder = get_overview_builders()[option]
+    if option in cube_charts:
+        return builder(cube)
+    return builder(frame)
+
+
+# serialized figures by (dataset version, option); the data only changes
+# with a new dataset version, so switching tabs is a lookup
+_figure_cache = dict()
+_figure_lock = threading.Lock()
+
+
+def get_overview_figure(option, ds):
+    key = (ds.version, option)
+    fig_json = _figure_cache.get(key)
+    if fig_json is None:
+        fig_json = build_overview_figure(option, ds.frame, ds.cube).to_json()
+        with _figure_lock:
+            for stale in [k for k in _figure_cache if k[0] != ds.version]:
+                del _figure_cache[stale]
+            _figure_cache[key] = fig_json
+    return json.loads(fig_json)
@@ -0,0 +1,304 @@
+import argparse
+import io
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import columnar
+import dataset
+import images
+import utils
+
+logger = logging.getLogger(__name__)
+
+development_csv = os.path.join(dataset.assets_dir, 'database_development.csv')
+# the shipped display csv carries hand edits the development csv does not
+# have, so builds go next to it and replacing it is a deliberate step
+built_csv = os.path.join(dataset.assets_dir, 'database_display_built.csv')
+row_cache_path = os.path.join(dataset.assets_dir, 'database_display_rows.npz')
+
+# bumped whenever the derivation rules change, so cached rows are rebuilt
+pipeline_version = 1
+
+numeric_fields = ['Project Plant Year',
+                  'Project Built Year',
+                  'Project Latitude',
+                  'Project Longitude',
+                  'System Rating',
+                  'System Coverage',
+                  'System Specific Yield',
+                  'System Generation Measured',
+                  'System Generation Simulated']
+
+zero_filled_fields = ['System Coverage',
+                      'System Specific Yield',
+                      'System Generation Measured',
+                      'System Generation Simulated']
+
+unknown_filled_fields = ['Project Description',
+                         'Module Cell Type(s)']
+
+derived_fields = ['Simple System Building Element',
+                  'System Type Clean',
+                  'Map Symbols2',
+                  'Project Function Clean',
+                  'Array Orientation(s) Clean',
+                  'Map Sizes',
+                  'System Generation',
+                  'Map Colors']
+
+# the label mappings follow the curated display dataset, keys are lower case
+function_labels = {'academic': 'Institutional',
+                   'administration': 'Office',
+                   'agricultural': 'Industrial',
+                   'airport': 'Airport',
+                   'carport': 'Mobility',
+                   'civic': 'Civic',
+                   'commercial': 'Commerical',
+                   'furniture': 'Industrial',
+                   'hospital': 'Hospital',
+                   'hospitality': 'Hospitality',
+                   'hotel': 'Hospitality',
+                   'hut': 'Civic',
+                   'industrial': 'Industrial',
+                   'institutional': 'Institutional',
+                   'laboratory': 'Institutional',
+                   'mixed': 'Mixed',
+                   'mixed use': 'Mixed',
+                   'mobility': 'Office',
+                   'multi family': 'Multi Residential',
+                   'multi family residential': 'Multi Residential',
+                   'museum': 'Civic',
+                   'office': 'Office',
+                   'parking': 'Mobility',
+                   'recreation': 'Civic',
+                   'restaurant': 'Hospitality',
+                   'school': 'Office',
+                   'showcase': 'Civic',
+                   'single family': 'Single Residential',
+                   'single family residential': 'Single Residential',
+                   'sport': 'Civic',
+                   'stadium': 'Stadium',
+                   'train': 'Mobility',
+                   'utility': 'Industrial',
+                   'worship': 'Worship'}
+
+element_labels = {'accessory system': 'Shading',
+                  'canopy': 'Canopy',
+                  'canopy facade': 'Facade',
+                  'canopy roof': 'Roof',
+                  'cold facade': 'Facade',
+                  'curved glass roof': 'Glazed',
+                  'curved warm facade': 'Facade',
+                  'double skin facade': 'Facade',
+                  'facade': 'Facade',
+                  'flat roof': 'Roof',
+                  'glass roof': 'Glazed',
+                  'glazed facade': 'Glazed',
+                  'louver': 'Shading',
+                  'louvre': 'Shading',
+                  'pitched glass roof': 'Roof',
+                  'pitched roof': 'Roof',
+                  'pitched roof & cold facade': 'Mixed',
+                  'roof': 'Roof',
+                  'roof_accessory': 'Roof',
+                  'rooftop': 'Roof',
+                  'rooftop and facade': 'Mixed',
+                  'rooftop and skylight': 'Mixed',
+                  'skylight': 'Glazed',
+                  'skylight and facade': 'Mixed',
+                  'sloped roof': 'Roof',
+                  'variety': 'Mixed',
+                  'warm facade': 'Facade'}
+
+system_type_labels = {'attached': 'Attached',
+                      'integrated': 'Integrated',
+                      'integrated facade': 'Integrated',
+                      'integrated glazing': 'Integrated',
+                      'integrated_roof': 'Integrated',
+                      'integrated_attached': 'Mixed',
+                      'mixed': 'Mixed'}
+
+element_symbols = {'Canopy': 'triangle',
+                   'Facade': 'square',
+                   'Glazed': 'diamond',
+                   'Mixed': 'heart',
+                   'Roof': 'airfield',
+                   'Shading': 'embassy',
+                   'Unknown': 'circle'}
+
+compass_degrees = {'n': 0, 'north': 0,
+                   'ne': 45, 'northeast': 45,
+                   'e': 90, 'east': 90,
+                   'se': 135, 'southeast': 135,
+                   's': 180, 'south': 180,
+                   'sw': 225, 'southwest': 225,
+                   'w': 270, 'west': 270,
+                   'nw': 315, 'northwest': 315}
+
+transparency_labels = {'opaque': 0, 'diffuse': 20}
+
+# marker size by system rating in kW, as in the map legend
+rating_bins = [-np.inf, 5, 20, 100, np.inf]
+rating_sizes = [8, 10, 14, 22]
+
+
+def read_development_csv(path=development_csv):
+    # the file is utf-8 apart from lines pasted in from Mac Roman sources
+    with open(path, 'rb') as fp:
+        raw = fp.read()
+    lines = []
+    for line in raw.split(b'\n'):
+        try:
+            lines.append(line.decode('utf-8'))
+        except UnicodeDecodeError:
+            lines.append(line.decode('mac_roman'))
+    # read as text so a row hashes the same whatever its neighbours contain
+    return pd.read_csv(io.StringIO('\n'.join(lines)), dtype=str)
+
+
+def row_hashes(dev):
+    return pd.util.hash_pandas_object(dev, index=False).values
+
+
+def map_labels(values, labels, default='Unknown'):
+    keys = values.str.strip().str.lower()
+    out = keys.map(labels)
+    unmapped = keys[out.isna() & keys.notna()].unique()
+    if len(unmapped):
+        logger.warning("%s: no label for %s", values.name, ', '.join(sorted(unmapped)))
+    return out.fillna(default)
+
+
+def clean_orientation(values):
+    text = values.str.strip()
+    degrees = pd.to_numeric(text, errors='coerce')
+    compass = text.str.lower().str.replace(' ', '', regex=False).map(compass_degrees)
+    multiple = text.str.contains('[_-]', regex=True).fillna(False).values
+    return pd.Series(np.select([multiple, degrees.notna().values, compass.notna().values],
+                               [np.full(len(text), 'Mixed', dtype=object),
+                                degrees.map('{:.0f}'.format).values,
+                                compass.map('{:.0f}'.format).values],
+                               'Unknown'),
+                     index=values.index)
+
+
+def derive_rows(dev):
+    """The display columns of the given development rows, row by row.
+
+    Everything here depends on the row alone, which is what lets the
+    results be cached by row hash; selection and ordering come after.
+    """
+    out = dev.copy()
+    for col in numeric_fields:
+        out[col] = pd.to_numeric(dev[col], errors='coerce')
+    for col in zero_filled_fields:
+        out[col] = out[col].fillna(0.0)
+    for col in unknown_filled_fields:
+        out[col] = dev[col].fillna('Unknown')
+
+    transparency = dev['Module Transparency'].str.strip().str.lower()
+    transparency = pd.to_numeric(transparency.replace(transparency_labels), errors='coerce')
+    out['Module Transparency'] = transparency.fillna(0).round().astype(int)
+
+    out['Project Type'] = utils.project_types(out['Project Built Year'], out['Project Plant Year'])
+    out['Simple System Building Element'] = map_labels(dev['System Building Element'], element_labels)
+    out['System Type Clean'] = map_labels(dev['System Type'], system_type_labels)
+    out['Map Symbols2'] = out['Simple System Building Element'].map(element_symbols)
+    out['Project Function Clean'] = map_labels(dev['Project Function'], function_labels)
+    out['Array Orientation(s) Clean'] = clean_orientation(dev['Array Orientation(s)'])
+    out['Map Sizes'] = pd.cut(out['System Rating'], rating_bins,
+                              labels=rating_sizes).astype(float).fillna(rating_sizes[0]).astype(int)
+    # the larger of the measured and simulated generation
+    out['System Generation'] = np.fmax(out['System Generation Measured'],
+                                       out['System Generation Simulated'])
+    colors = utils.get_color_dict()
+    out['Map Colors'] = np.where(out['Project Type'] == 'Retrofit',
+                                 colors['retrofit_cat'], colors['new_cat'])
+    return out
+
+
+def select_projects(rows):
+    # located projects with both years, from 2000 on, not marked to drop
+    keep = (rows['Keep'].str.lower() != 'false')
+    keep &= rows['Project Latitude'].notna() & rows['Project Longitude'].notna()
+    keep &= rows['Project Built Year'].notna() & rows['Project Plant Year'].notna()
+    keep &= rows['Project Plant Year'] >= 2000
+    return rows[keep.values]
+
+
+def resolve_image_names(names):
+    # photos are stored with a _g or _o suffix, projects without one show
+    # the placeholder
+    available = set(images.list_originals())
+    out = names.copy()
+    for suffix in ['_o', '_g', '']:
+        candidate = names + suffix
+        out = out.where(~candidate.isin(available), candidate)
+    return out.where(out.isin(available), images.placeholder_name)
+
+
+def finish_display(rows):
+    display = select_projects(rows)
+    display = display.sort_values('Project Built Year', ascending=False, kind='mergesort')
+    display = display.reset_index(drop=True)
+    for col in ['Project Plant Year', 'Project Built Year']:
+        display[col] = display[col].astype(int)
+    display['Image Name'] = resolve_image_names(display['Image Name'])
+    return display
+
+
+def load_row_cache(path=row_cache_path):
+    if not os.path.exists(path):
+        return None
+    meta = columnar.read_columnar_meta(path)['metadata']
+    if meta.get('pipeline_version') != pipeline_version:
+        return None
+    return columnar.read_columnar(path)
+
+
+def build_display(dev_path=development_csv, out_path=built_csv,
+                  cache_path=row_cache_path, full=False):
+    """Derive the display dataset from the development dataset.
+
+    Derived rows are cached by the hash of their development row, so only
+    new or edited projects are processed again; rows no longer in the
+    development dataset are dropped from the cache.
+    """
+    dev = read_development_csv(dev_path)
+    hashes = row_hashes(dev)
+    cached = None if full else load_row_cache(cache_path)
+    if cached is None:
+        reused = np.zeros(len(dev), dtype=bool)
+    else:
+        reused = np.isin(hashes, cached.index.values)
+
+    derived = derive_rows(dev[~reused])
+    derived.index = hashes[~reused]
+    if cached is not None and reused.any():
+        derived = pd.concat([cached.loc[np.unique(hashes[reused]), derived.columns], derived])
+    rows = derived[~derived.index.duplicated()].loc[hashes]
+    logger.info("%d development rows: %d reused, %d processed",
+                len(dev), reused.sum(), (~reused).sum())
+
+    columns = list(dev.columns) + derived_fields
+    rows = rows[columns]
+    columnar.write_columnar(rows[~rows.index.duplicated()], cache_path,
+                            metadata={'pipeline_version': pipeline_version})
+    display = finish_display(rows)
+    display.to_csv(out_path)
+    return display
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Derive the display dataset from the development dataset.')
+    parser.add_argument('--development', default=development_csv)
+    parser.add_argument('--out', default=built_csv)
+    parser.add_argument('--cache', default=row_cache_path)
+    parser.add_argument('--full', action='store_true', help='reprocess every row, ignoring the cache')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    built = build_display(args.development, args.out, args.cache, full=args.full)
+    print(f"{args.out}: {len(built)} projects")
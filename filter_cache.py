@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from flask_caching import Cache
+
+import filters
+from search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# the cached results are pickles, so the directory must only be writable by
+# the app: by default it is next to the app, never in the shared temp dir
+cache_dir = os.getenv('UIPV_APP_CACHE_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+cache_ttl = int(os.getenv('UIPV_APP_FILTER_CACHE_TTL', 3600))
+cache_max_bytes = int(os.getenv('UIPV_APP_FILTER_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+cache_max_items = int(os.getenv('UIPV_APP_FILTER_CACHE_MAX_ITEMS', 20000))
+# pickling and the file system add about this much to every stored result
+entry_overhead_bytes = 4096
+
+# hit rate is logged every this many lookups
+log_every = 100
+
+cache = Cache()
+
+
+def entry_bytes(n_rows):
+    # a result is a bitmap of the dataset's rows
+    return (n_rows + 7) // 8 + entry_overhead_bytes
+
+
+def cache_config(n_rows):
+    # the file system backend is shared by every gunicorn worker on the
+    # machine and can only bound its number of files; with results of equal
+    # size that bounds the bytes as well
+    return {'CACHE_TYPE': 'FileSystemCache',
+            'CACHE_DIR': cache_dir,
+            'CACHE_DEFAULT_TIMEOUT': cache_ttl,
+            'CACHE_THRESHOLD': max(1, min(cache_max_items, cache_max_bytes // entry_bytes(n_rows)))}
+
+
+def private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.stat(path).st_uid != os.getuid():
+        raise RuntimeError(f'the cache directory {path} is owned by another user')
+    os.chmod(path, 0o700)
+    return path
+
+
+def init_cache(server, n_rows, config=None):
+    config = config or cache_config(n_rows)
+    if config.get('CACHE_DIR'):
+        private_dir(config['CACHE_DIR'])
+    cache.init_app(server, config=config)
+
+
+def _sorted_or_none(values):
+    if values is None:
+        return None
+    return sorted(set(str(v) for v in values))
+
+
+def _range_or_none(values):
+    if values is None:
+        return None
+    return [float(v) for v in values]
+
+
+def canonical_filter_state(date_range, functions, sys_type, elements, coverage,
+                           sp_yield, generation, orientation, cells, transparency,
+                           search_term):
+    # equal filter selections give equal states whatever order the checklist
+    # values or search words arrive in
+    terms = sorted(set(tokenize(search_term))) if search_term else []
+    return {'built_year': _range_or_none(date_range),
+            'functions': _sorted_or_none(functions),
+            'system_type': _sorted_or_none(sys_type),
+            'elements': _sorted_or_none(elements),
+            'coverage': _range_or_none(coverage),
+            'specific_yield': _range_or_none(sp_yield),
+            'generation': _range_or_none(generation),
+            'orientation': _range_or_none(orientation),
+            'cell_types': _sorted_or_none(cells),
+            'transparency': _range_or_none(transparency),
+            'search': terms or None}
+
+
+def state_values(state):
+    # the filter values of a canonical state, in the order the map callbacks
+    # take them; their canonical state is that state again
+    return (state['built_year'], state['functions'], state['system_type'], state['elements'],
+            state['coverage'], state['specific_yield'], state['generation'], state['orientation'],
+            state['cell_types'], state['transparency'],
+            ' '.join(state['search']) if state['search'] else None)
+
+
+def filter_key(version, *filter_values):
+    state = json.dumps(canonical_filter_state(*filter_values), sort_keys=True)
+    return 'filter-' + hashlib.sha1(f'{version}:{state}'.encode()).hexdigest()
+
+
+class HitCounter:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            lookups = self.hits + self.misses
+        if lookups % log_every == 0:
+            logger.info("filter cache: %d lookups, %.1f%% hit rate (pid %d)",
+                        lookups, 100 * self.hit_rate(), os.getpid())
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+counter = HitCounter()
+
+
+def pack_positions(positions, n_rows):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[positions] = True
+    return np.packbits(mask)
+
+
+def unpack_positions(bits):
+    # the padding bits of the last byte are never set
+    return np.flatnonzero(np.unpackbits(bits))
+
+
+def cached_positions(key, version):
+    # the row positions stored under a key, None if unknown or of another version
+    entry = cache.get(key)
+    if entry is None or entry[0] != version:
+        return None
+    return unpack_positions(entry[1])
+
+
+def cached_filter_positions(ds, *filter_values):
+    """The key and row positions of the result of a filter selection.
+
+    Each result is stored once, as a bitmap of the dataset's rows, under a
+    key of the dataset version and the filter state; the key doubles as the
+    token of the result in the browser.
+    """
+    key = filter_key(ds.version, *filter_values)
+    positions = cached_positions(key, ds.version)
+    counter.record(positions is not None)
+    if positions is None:
+        positions = filters.filter_positions(ds, *filter_values)
+        cache.set(key, (ds.version, pack_positions(positions, len(ds))))
+    return key, positions
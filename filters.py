@@ -0,0 +1,44 @@
+import numpy as np
+
+import utils
+
+
+def filter_positions(ds, date_range, functions, sys_type, elements, coverage,
+                     sp_yield, generation, orientation, cells, transparency,
+                     search_term):
+    # every predicate is evaluated over the full dataset and combined before
+    # any rows are copied out of it
+    df = ds.frame
+    bitmaps = ds.bitmaps
+    bits = bitmaps.match_all({'Project Function Clean': functions,
+                              'System Type Clean': sys_type,
+                              'Simple System Building Element': elements,
+                              'Module Cell Type(s)': cells})
+    mask = bitmaps.to_mask(bits)
+    years, year_labels = ds.mixed["Project Built Year"]
+    mask &= utils.mask_numeric_range(years,  # filter plant year
+                                     year_labels,
+                                     date_range,
+                                     clip=(1945, None))
+    mask &= utils.mask_df_range(df,
+                                coverage,
+                                "System Coverage")
+    mask &= utils.mask_df_range(df,  # filter specific yield
+                                sp_yield,
+                                "System Specific Yield",
+                                new_dtype=float)
+    mask &= utils.mask_df_range(df,  # filter generation
+                                generation,
+                                "System Generation",
+                                new_dtype=float)
+    angles, orientation_labels = ds.mixed["Array Orientation(s) Clean"]
+    mask &= utils.mask_angle_range(angles,
+                                   orientation_labels,
+                                   orientation)
+    # mask &= utils.mask_df_range(df,  # filter transparency
+    #                             transparency,
+    #                             "Module Transparency",
+    #                             new_dtype=float)
+    if search_term != None:
+        mask &= ds.search.mask(search_term)
+    return np.flatnonzero(mask)
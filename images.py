@@ -0,0 +1,128 @@
+import argparse
+import base64
+import io
+import json
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from lru import SizedLRUCache
+
+PARENT_DIR = Path(__file__).parent.resolve()
+images_dir = os.path.join(PARENT_DIR, 'assets', 'images')
+derived_dir = os.path.join(images_dir, 'derived')
+manifest_path = os.path.join(derived_dir, 'manifest.json')
+
+placeholder_name = 'placeholder'
+
+# longest edge in pixels and encoder quality of each derived variant
+variants = {'thumb': {'max_size': 320, 'quality': 75},   # map hover tooltip
+            'medium': {'max_size': 800, 'quality': 80}}  # project modal
+
+# memory ceiling of the per-worker cache of base64 encoded images
+image_cache_bytes = int(os.getenv('UIPV_APP_IMAGE_CACHE_BYTES', 32 * 1024 * 1024))
+
+formats = {'jpeg': {'extension': 'jpg', 'mime': 'image/jpeg'},
+           'webp': {'extension': 'webp', 'mime': 'image/webp'}}
+
+
+def original_path(image_name):
+    return os.path.join(images_dir, f'{image_name}.jpg')
+
+
+def list_originals():
+    # the .png files are duplicates of the .jpg originals
+    return sorted(Path(p).stem for p in os.listdir(images_dir) if p.endswith('.jpg'))
+
+
+def make_derivative(im, max_size, quality, image_format='jpeg'):
+    out = im.convert('RGB')
+    out.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    out.save(buffer, format=image_format, quality=quality, optimize=True)
+    return buffer.getvalue(), out.size
+
+
+def build_derivatives(names=None, image_format='jpeg', out_dir=derived_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    extension = formats[image_format]['extension']
+    manifest = load_manifest(os.path.join(out_dir, 'manifest.json'))
+    if manifest is None or manifest['format'] != image_format or names is None:
+        manifest = {'format': image_format,
+                    'mime': formats[image_format]['mime'],
+                    'images': dict()}
+    if names is None:
+        names = list_originals()
+    for name in names:
+        entry = dict()
+        with Image.open(original_path(name)) as im:
+            for variant, spec in variants.items():
+                data, size = make_derivative(im, spec['max_size'], spec['quality'], image_format)
+                file_name = f'{name}_{variant}.{extension}'
+                with open(os.path.join(out_dir, file_name), 'wb') as fp:
+                    fp.write(data)
+                entry[variant] = {'file': file_name,
+                                  'bytes': len(data),
+                                  'width': size[0],
+                                  'height': size[1]}
+        manifest['images'][name] = entry
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True)
+    return manifest
+
+
+def load_manifest(path=manifest_path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+_manifest = load_manifest()
+
+
+def image_name_or_placeholder(image_name):
+    if not isinstance(image_name, str):
+        return placeholder_name
+    return image_name
+
+
+def read_image(image_name, variant):
+    # returns (bytes, mime) of the prebuilt derivative, re-encoding the
+    # original only when the derivative has not been built
+    image_name = image_name_or_placeholder(image_name)
+    if _manifest is not None and image_name in _manifest['images']:
+        entry = _manifest['images'][image_name][variant]
+        with open(os.path.join(derived_dir, entry['file']), 'rb') as fp:
+            return fp.read(), _manifest['mime']
+    with Image.open(original_path(image_name)) as im:
+        buffer = io.BytesIO()
+        im.save(buffer, format="jpeg")
+    return buffer.getvalue(), 'image/jpeg'
+
+
+def _encode_image(image_name, variant):
+    data, mime = read_image(image_name, variant)
+    return f"data:{mime};base64, " + base64.b64encode(data).decode()
+
+
+image_cache = SizedLRUCache(image_cache_bytes)
+
+
+def encode_image(image_name, variant):
+    # repeat hovers on popular projects are served from the cache
+    image_name = image_name_or_placeholder(image_name)
+    return image_cache.get_or_create((image_name, variant),
+                                     lambda: _encode_image(image_name, variant))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the tooltip and modal image derivatives.')
+    parser.add_argument('--format', choices=sorted(formats), default='jpeg')
+    parser.add_argument('names', nargs='*', help='image names (default: every original)')
+    args = parser.parse_args()
+    built = build_derivatives(names=args.names or None, image_format=args.format)
+    for name, entry in built['images'].items():
+        sizes = ', '.join(f"{v} {e['bytes'] / 1024:.0f} KB" for v, e in entry.items())
+        print(f"{name}: {sizes}")
@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+
+import utils
+
+# mapbox draws the whole world this many pixels wide at zoom 0
+world_pixels = 512
+# a cluster covers a grid cell about this many pixels wide at its zoom
+cell_pixels = 64
+# below this zoom the map shows clusters, from it on single projects
+cluster_zoom = int(os.getenv('UIPV_APP_MAP_CLUSTER_ZOOM', 6))
+max_level = max(cluster_zoom - 1, 0)
+# the web mercator latitude limit
+max_latitude = 85.0511
+
+
+def zoom_level(zoom):
+    # the pyramid level shown at a mapbox zoom, None for single projects
+    if zoom is None:
+        zoom = 1  # the mapbox default
+    if zoom >= cluster_zoom:
+        return None
+    return max(int(np.floor(zoom)), 0)
+
+
+def cells_per_axis(level):
+    return world_pixels * 2 ** level // cell_pixels
+
+
+def mercator_xy(lat, lon):
+    # position on the square web mercator map, both in [0, 1)
+    x = (np.asarray(lon, dtype=float) + 180) / 360
+    sin_lat = np.sin(np.radians(np.clip(np.asarray(lat, dtype=float), -max_latitude, max_latitude)))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)
+    return np.clip(x, 0, 1 - 1e-12), np.clip(y, 0, 1 - 1e-12)
+
+
+class MapPyramid:
+    """Grid cells of the projects on the map at every clustered zoom level.
+
+    Each row is placed in its cell of the finest level once, the cells of a
+    coarser level are those of the next finer one merged in fours. Counts,
+    summed generation, the retrofit count and the summed coordinates of the
+    cells (for a cluster at the mean position of its projects) are built
+    for the whole dataset when it loads; the cells of a selection of rows
+    cost a pass over those rows at the requested level.
+    """
+
+    def __init__(self, cell_x, cell_y, row_measures, levels):
+        self.cell_x = cell_x
+        self.cell_y = cell_y
+        self.row_measures = row_measures
+        self.levels = levels
+
+    @classmethod
+    def build(cls, df):
+        x, y = mercator_xy(df['Project Latitude'].values, df['Project Longitude'].values)
+        n = cells_per_axis(max_level)
+        cell_x = (x * n).astype(np.int64)
+        cell_y = (y * n).astype(np.int64)
+        retrofit = utils.project_types(df['Project Built Year'].values,
+                                       df['Project Plant Year'].values) == 'Retrofit'
+        row_measures = {'generation': np.nan_to_num(df['System Generation'].values.astype(float)),
+                        'retrofit': retrofit.astype(float),
+                        'lat': np.nan_to_num(df['Project Latitude'].values.astype(float)),
+                        'lon': np.nan_to_num(df['Project Longitude'].values.astype(float))}
+        pyramid = cls(cell_x, cell_y, row_measures, dict())
+        finest = pyramid.cells(max_level)
+        pyramid.levels[max_level] = finest
+        for level in range(max_level - 1, -1, -1):
+            finest = pyramid.merge(finest, level)
+            pyramid.levels[level] = finest
+        return pyramid
+
+    def cells(self, level, positions=None):
+        """The occupied cells of the given rows (all by default) at a level.
+
+        A dict of arrays with an entry per cell: its key, the count, the
+        sums of the row measures and the first row in it, which is the
+        project itself for cells holding only one.
+        """
+        if positions is None:
+            positions = np.arange(len(self.cell_x))
+        shift = max_level - level
+        keys = (self.cell_x[positions] >> shift) * cells_per_axis(level) + (self.cell_y[positions] >> shift)
+        keys, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True,
+                                                 return_counts=True)
+        cells = {'key': keys, 'count': counts, 'first': positions[first]}
+        for measure, values in self.row_measures.items():
+            cells[measure] = np.bincount(inverse, weights=values[positions], minlength=len(keys))
+        return cells
+
+    def merge(self, cells, level):
+        # the cells of a level from those of the level below it
+        n_below = cells_per_axis(level + 1)
+        x, y = np.divmod(cells['key'], n_below)
+        keys = (x >> 1) * cells_per_axis(level) + (y >> 1)
+        keys, inverse = np.unique(keys, return_inverse=True)
+        merged = {'key': keys}
+        for measure in ['count'] + list(self.row_measures):
+            merged[measure] = np.bincount(inverse, weights=cells[measure], minlength=len(keys))
+        merged['count'] = merged['count'].astype(np.int64)
+        merged['first'] = np.full(len(keys), np.iinfo(np.int64).max)
+        np.minimum.at(merged['first'], inverse, cells['first'])
+        return merged
+
+    def level_cells(self, level, positions=None):
+        if positions is None:
+            return self.levels[level]
+        return self.cells(level, positions)
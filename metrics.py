@@ -0,0 +1,221 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+import flask
+
+logger = logging.getLogger(__name__)
+
+# every worker writes its counts to this directory, /metrics adds up those of
+# the workers of the same gunicorn master
+metrics_dir = os.getenv('UIPV_APP_METRICS_DIR',
+                        os.path.join(tempfile.gettempdir(), 'uipvapp_metrics'))
+
+# a worker's counts are written at most this often, and on every scrape
+flush_seconds = 5
+
+# files of earlier runs are removed once they are this old
+stale_seconds = 24 * 3600
+
+duration_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+size_buckets = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+histograms = {'duration': ('uipv_callback_duration_seconds', duration_buckets,
+                           'Wall time of Dash callback requests.'),
+              'request_bytes': ('uipv_callback_request_bytes', size_buckets,
+                                'Body size of Dash callback requests.'),
+              'response_bytes': ('uipv_callback_response_bytes', size_buckets,
+                                 'Body size of Dash callback responses.')}
+
+
+def empty_callback():
+    return {'errors': 0,
+            **{name: {'counts': [0] * (len(buckets) + 1), 'sum': 0.0}
+               for name, (_, buckets, _) in histograms.items()}}
+
+
+class CallbackMetrics:
+    """Histograms of the callback requests served by this worker."""
+
+    def __init__(self):
+        self.callbacks = dict()
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+
+    def observe(self, callback, duration, request_bytes, response_bytes, error):
+        values = {'duration': duration,
+                  'request_bytes': request_bytes,
+                  'response_bytes': response_bytes}
+        with self._lock:
+            entry = self.callbacks.setdefault(callback, empty_callback())
+            for name, value in values.items():
+                # the first bucket the value fits in; the last one is +Inf
+                entry[name]['counts'][bisect_left(histograms[name][1], value)] += 1
+                entry[name]['sum'] += value
+            entry['errors'] += bool(error)
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.callbacks))
+
+    def flush(self, caches, force=False):
+        now = time.time()
+        if not force and now - self._flushed < flush_seconds:
+            return
+        self._flushed = now
+        data = {'callbacks': self.snapshot(), 'caches': caches()}
+        os.makedirs(metrics_dir, exist_ok=True)
+        path = worker_path()
+        # written aside and renamed, so a scrape never reads half a file
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(data, fp)
+        os.replace(path + '.tmp', path)
+
+
+registry = CallbackMetrics()
+
+
+def worker_path(pid=None):
+    return os.path.join(metrics_dir, f'{os.getppid()}-{pid or os.getpid()}.json')
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # a process of another user
+        return True
+    return True
+
+
+def cache_stats():
+    # imported here so that metrics can be set up before the app modules
+    import filter_cache
+    import images
+    import overview_selection
+    stats = {'image': images.image_cache.stats(),
+             'overview_figure': overview_selection.figure_cache.stats(),
+             'overview_cube': overview_selection.cube_cache.stats(),
+             'filter': {'hits': filter_cache.counter.hits,
+                        'misses': filter_cache.counter.misses}}
+    return stats
+
+
+def read_workers():
+    """The counts of every running worker of this server, this one's up to
+    date; the files of exited workers are removed."""
+    registry.flush(cache_stats, force=True)
+    workers = []
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        try:
+            parent, pid = os.path.basename(path)[:-len('.json')].split('-')
+            if parent != str(os.getppid()):
+                if time.time() - os.path.getmtime(path) > stale_seconds:
+                    os.remove(path)
+                continue
+            if not pid_alive(int(pid)):
+                # a worker that exited or was restarted by the master
+                os.remove(path)
+                continue
+            with open(path) as fp:
+                workers.append(json.load(fp))
+        except (OSError, ValueError):
+            logger.warning("skipped unreadable metrics file %s", path)
+    return workers
+
+
+def merge_workers(workers):
+    callbacks = dict()
+    caches = dict()
+    for worker in workers:
+        for callback, entry in worker['callbacks'].items():
+            total = callbacks.setdefault(callback, empty_callback())
+            total['errors'] += entry['errors']
+            for name in histograms:
+                total[name]['counts'] = [a + b for a, b in zip(total[name]['counts'], entry[name]['counts'])]
+                total[name]['sum'] += entry[name]['sum']
+        for cache, stats in worker['caches'].items():
+            total = caches.setdefault(cache, dict())
+            for stat, value in stats.items():
+                total[stat] = total.get(stat, 0) + value
+    return callbacks, caches
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(workers):
+    """The merged counts in the Prometheus text exposition format."""
+    callbacks, caches = merge_workers(workers)
+    lines = ['# HELP uipv_worker_processes Workers that have reported metrics.',
+             '# TYPE uipv_worker_processes gauge',
+             f'uipv_worker_processes {len(workers)}']
+    for name, (metric, buckets, description) in histograms.items():
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+        for callback in sorted(callbacks):
+            entry = callbacks[callback][name]
+            cumulative = 0
+            for bound, count in zip(buckets + ['+Inf'], entry['counts']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{callback="{callback}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{callback="{callback}"}} {format_value(entry["sum"])}')
+            lines.append(f'{metric}_count{{callback="{callback}"}} {cumulative}')
+    lines += ['# HELP uipv_callback_errors_total Dash callback requests that failed.',
+              '# TYPE uipv_callback_errors_total counter']
+    lines += [f'uipv_callback_errors_total{{callback="{callback}"}} {callbacks[callback]["errors"]}'
+              for callback in sorted(callbacks)]
+    cache_metrics = [('hits', 'uipv_cache_hits_total', 'counter', 'Cache lookups that found a value.'),
+                     ('misses', 'uipv_cache_misses_total', 'counter', 'Cache lookups that found nothing.'),
+                     ('evictions', 'uipv_cache_evictions_total', 'counter', 'Values evicted from the cache.'),
+                     ('entries', 'uipv_cache_entries', 'gauge', 'Values in the cache.'),
+                     ('bytes', 'uipv_cache_bytes', 'gauge', 'Size of the values in the cache.')]
+    for stat, metric, kind, description in cache_metrics:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {kind}']
+        lines += [f'{metric}{{cache="{cache}"}} {caches[cache][stat]}'
+                  for cache in sorted(caches) if stat in caches[cache]]
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, path='/metrics'):
+    """Time every callback request of the Dash app and serve the counts."""
+    server = app.server
+
+    def callback_name():
+        body = flask.request.get_json(silent=True) or dict()
+        entry = app.callback_map.get(body.get('output'), dict())
+        callback = entry.get('callback')
+        return callback.__name__ if callback is not None else 'unknown'
+
+    @server.before_request
+    def start_timer():
+        if flask.request.path.endswith('/_dash-update-component'):
+            flask.g.metrics_started = time.perf_counter()
+
+    @server.after_request
+    def record_callback(response):
+        started = flask.g.pop('metrics_started', None)
+        if started is not None:
+            # 204 is a callback that prevented the update, not an error
+            registry.observe(callback_name(),
+                             time.perf_counter() - started,
+                             flask.request.content_length or 0,
+                             response.calculate_content_length() or 0,
+                             response.status_code >= 400)
+            try:
+                registry.flush(cache_stats)
+            except OSError:
+                logger.exception("could not write the metrics of pid %d", os.getpid())
+        return response
+
+    @server.route(path)
+    def metrics():
+        return flask.Response(render(read_workers()),
+                              mimetype='text/plain; version=0.0.4')
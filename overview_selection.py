@@ -0,0 +1,101 @@
+import json
+
+import numpy as np
+
+import dataset
+import db_overview
+import filter_cache
+import session_store
+from lru import SizedLRUCache
+
+# per worker caches of the overview for filtered selections, keyed by the
+# result token of the selection
+figure_cache = SizedLRUCache(16 * 1024 * 1024)
+cube_cache = SizedLRUCache(16 * 1024 * 1024, sizeof=lambda cube: cube.nbytes)
+
+
+class SelectionExpired(LookupError):
+    pass
+
+
+def map_selection(token, *filter_values):
+    # what the browser keeps of a filter result: its token, and the filter
+    # state to make it again once the stored rows have expired
+    return {'token': token, 'filters': filter_cache.canonical_filter_state(*filter_values)}
+
+
+def selection_positions(ds, selection):
+    """The token and row positions of a map selection, None and None for
+    every project.
+
+    The rows stored under the token expire, they are filtered again from the
+    filter state of the selection then. A selection without one raises
+    SelectionExpired, it is never taken for every project.
+    """
+    if selection is None:
+        return None, None
+    token = selection['token']
+    positions = session_store.result_store.get(token, ds.version)
+    if positions is not None:
+        return token, positions
+    if selection.get('filters') is None:
+        raise SelectionExpired(token)
+    token, positions = filter_cache.cached_filter_positions(ds, *filter_cache.state_values(selection['filters']))
+    session_store.result_store.put(token, positions, version=ds.version)
+    return token, positions
+
+
+def selection_cube(ds, token, positions):
+    cube = cube_cache.get(token)
+    if cube is None:
+        cube = cube_cache.put(token, ds.cube.select(positions))
+    return cube
+
+
+def track_selection(ds, token, positions, previous_token=None):
+    """Keep the cube of a new filter result as the map creates it.
+
+    A single filter edit changes few rows, so the cube is updated from that
+    of the selection it was made from, every project for a fresh map page,
+    when that one is cached in this worker.
+    """
+    if token in cube_cache:
+        return
+    if previous_token is None:
+        previous_cube = ds.cube
+        previous = np.ones(len(ds), dtype=bool)
+    else:
+        previous_cube = cube_cache.get(previous_token)
+        previous_positions = (session_store.result_store.get(previous_token, ds.version)
+                              if previous_cube is not None else None)
+        if previous_positions is None:
+            cube_cache.put(token, ds.cube.select(positions))
+            return
+        previous = np.zeros(len(ds), dtype=bool)
+        previous[previous_positions] = True
+    current = np.zeros(len(ds), dtype=bool)
+    current[positions] = True
+    added = np.flatnonzero(current & ~previous)
+    removed = np.flatnonzero(previous & ~current)
+    if len(added) + len(removed) < len(positions):
+        cube = previous_cube.copy().add_rows(added).remove_rows(removed)
+    else:
+        cube = ds.cube.select(positions)
+    cube_cache.put(token, cube)
+
+
+def overview_figure(option, selection=None):
+    ds = dataset.get_dataset()
+    token, positions = selection_positions(ds, selection)
+    if positions is None:
+        # no selection means every project
+        return db_overview.get_overview_figure(option, ds)
+    key = (ds.version, option, token)
+    fig_json = figure_cache.get(key)
+    if fig_json is None:
+        if option in db_overview.cube_charts:
+            fig = db_overview.build_overview_figure(option, None, selection_cube(ds, token, positions))
+        else:
+            fig = db_overview.build_overview_figure(option, ds.frame.iloc[positions], None)
+        fig_json = figure_cache.put(key, fig.to_json())
+    return json.loads(fig_json)
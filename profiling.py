@@ -0,0 +1,122 @@
+import cProfile
+import hmac
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+import flask
+
+logger = logging.getLogger(__name__)
+
+# profiling is only set up when a token is configured, a request asks for it
+# by sending the token in the header or query parameter below
+profile_token = os.getenv('UIPV_APP_PROFILE_TOKEN')
+profile_header = 'X-UIPV-Profile'
+profile_query = 'profile'
+
+profile_dir = os.getenv('UIPV_APP_PROFILE_DIR', os.path.join(os.getcwd(), 'profiles'))
+# the oldest profiles are removed beyond this many
+max_profiles = int(os.getenv('UIPV_APP_PROFILE_MAX_FILES', 20))
+traceback_frames = 10
+
+# one profiled request at a time, tracemalloc traces every thread
+_lock = threading.Lock()
+_sequence = itertools.count(1)
+
+
+def profile_name(output):
+    # e.g. map_markers.data-dataframe_temp.data for a multi output callback
+    name = re.sub(r'\.\.\.', '-', output.strip('.'))
+    return re.sub(r'[^\w.-]+', '_', name)[:100]
+
+
+def rotate(directory=None, keep=None):
+    directory = directory or profile_dir
+    keep = max_profiles if keep is None else keep
+    # a profile is the .prof and .tracemalloc pair of the same name
+    paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.prof')]
+    names = [os.path.splitext(p)[0] for p in sorted(paths, key=os.path.getmtime, reverse=True)]
+    for name in names[keep:]:
+        for ext in ['.prof', '.tracemalloc']:
+            path = name + ext
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def requested():
+    request = flask.request
+    if not request.path.endswith('/_dash-update-component'):
+        return False
+    value = request.headers.get(profile_header) or request.args.get(profile_query)
+    # compared in constant time, the token must not leak through timing
+    return value is not None and hmac.compare_digest(value.encode(), profile_token.encode())
+
+
+def write_profile(profiler, snapshot, output, seconds, peak_bytes):
+    os.makedirs(profile_dir, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_sequence)}-{profile_name(output)}"
+    path = os.path.join(profile_dir, name)
+    snapshot.dump(path + '.tracemalloc')
+    profiler.dump_stats(path + '.prof')
+    rotate()
+    logger.info("profiled %s: %.1f ms, peak %.1f MB traced, written to %s.*",
+                output, 1000 * seconds, peak_bytes / 1e6, path)
+    return name
+
+
+def init_profiling(server):
+    """Profile single callback requests on demand.
+
+    Without UIPV_APP_PROFILE_TOKEN no hooks are installed at all. With it, a
+    callback request carrying the token is run under cProfile and
+    tracemalloc, and the two results are written to the profile directory
+    as <time>-<pid>-<n>-<output>.prof and .tracemalloc; load them with
+    pstats.Stats and tracemalloc.Snapshot.load.
+    """
+    if not profile_token:
+        return
+
+    @server.before_request
+    def start_profile():
+        if not requested() or tracemalloc.is_tracing() or not _lock.acquire(blocking=False):
+            return
+        profiler = cProfile.Profile()
+        flask.g.profile = (profiler, time.perf_counter())
+        tracemalloc.start(traceback_frames)
+        profiler.enable()
+
+    @server.after_request
+    def stop_profile(response):
+        profile = flask.g.pop('profile', None)
+        if profile is None:
+            return response
+        profiler, started = profile
+        try:
+            profiler.disable()
+            seconds = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            body = flask.request.get_json(silent=True) or dict()
+            name = write_profile(profiler, snapshot, body.get('output', 'unknown'), seconds, peak_bytes)
+            response.headers[profile_header] = name
+        except OSError:
+            logger.exception("could not write the profile")
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _lock.release()
+        return response
+
+    @server.teardown_request
+    def abandon_profile(exc):
+        # a request that failed before its response was made
+        profile = flask.g.pop('profile', None)
+        if profile is not None:
+            profile[0].disable()
+            tracemalloc.stop()
+            _lock.release()
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+import utils
+
+# dimensions and summed measures of the overview cube; 'Project Type' is the
+# built vs retrofit split derived from the built and plant years
+cube_dimensions = ['Project Plant Year',
+                   'Project Type',
+                   'Simple System Building Element',
+                   'Project Function Clean',
+                   'System Type Clean',
+                   'Project Country']
+
+cube_measures = ['System Rating',
+                 'System Generation',
+                 'System Coverage']
+
+
+def dimension_codes(df, dimension):
+    if dimension == 'Project Type':
+        built_year = df['Project Built Year'].values
+        plant_year = df['Project Plant Year'].values
+        values = pd.Series(utils.project_types(built_year, plant_year))
+        values[pd.isna(built_year) | pd.isna(plant_year)] = np.nan
+    else:
+        values = df[dimension]
+    # labels in order of first appearance, missing values get code -1
+    codes, labels = pd.factorize(values, sort=False)
+    return codes, list(labels)
+
+
+class RollupCube:
+    """Counts and sums of the projects over every non-empty combination of
+    the cube dimensions, built in one pass when the dataset loads.
+
+    Each row is mapped to its cell once, so the cube for any selection of
+    rows, or a change to that selection, costs a bincount over those rows,
+    and every rollup after that is proportional to the number of cells.
+    """
+
+    def __init__(self, dimensions, labels, cell_codes, row_cells, row_measures):
+        self.dimensions = dimensions
+        self.labels = labels
+        self.cell_codes = cell_codes
+        self.row_cells = row_cells
+        self.row_measures = row_measures
+        self.n_cells = len(cell_codes[0])
+        self.counts = np.zeros(self.n_cells)
+        self.sums = {m: np.zeros(self.n_cells) for m in row_measures}
+
+    @classmethod
+    def build(cls, df, dimensions=cube_dimensions, measures=cube_measures):
+        codes = []
+        labels = []
+        for dimension in dimensions:
+            dimension_code, dimension_labels = dimension_codes(df, dimension)
+            # missing values take the last code of the dimension
+            dimension_code = np.where(dimension_code < 0, len(dimension_labels), dimension_code)
+            codes.append(dimension_code)
+            labels.append(dimension_labels)
+        shape = tuple(len(x) + 1 for x in labels)
+        flat = np.ravel_multi_index(codes, shape)
+        cells, row_cells = np.unique(flat, return_inverse=True)
+        cell_codes = np.unravel_index(cells, shape)
+        row_measures = {m: np.nan_to_num(df[m].values.astype(float)) for m in measures}
+        cube = cls(dimensions, labels, cell_codes, row_cells, row_measures)
+        return cube.add_rows(np.arange(len(df)))
+
+    @property
+    def nbytes(self):
+        # the per selection arrays; the row to cell mapping is shared
+        return self.counts.nbytes + sum(v.nbytes for v in self.sums.values())
+
+    def copy(self):
+        cube = RollupCube(self.dimensions, self.labels, self.cell_codes,
+                          self.row_cells, self.row_measures)
+        cube.counts = self.counts.copy()
+        cube.sums = {m: v.copy() for m, v in self.sums.items()}
+        return cube
+
+    def _accumulate(self, positions, sign):
+        cells = self.row_cells[positions]
+        self.counts += sign * np.bincount(cells, minlength=self.n_cells)
+        for m, values in self.row_measures.items():
+            self.sums[m] += sign * np.bincount(cells, weights=values[positions],
+                                               minlength=self.n_cells)
+
+    def add_rows(self, positions):
+        self._accumulate(positions, 1)
+        return self
+
+    def remove_rows(self, positions):
+        self._accumulate(positions, -1)
+        return self
+
+    def select(self, positions):
+        # a cube over the given row positions only
+        cube = RollupCube(self.dimensions, self.labels, self.cell_codes,
+                          self.row_cells, self.row_measures)
+        return cube.add_rows(positions)
+
+    def rollup(self, dimensions, measures=None):
+        """Totals by the given dimensions as a DataFrame with a 'count' column
+        and one column per measure, omitting empty and missing-valued groups."""
+        if measures is None:
+            measures = list(self.sums)
+        axes = [self.dimensions.index(d) for d in dimensions]
+        sizes = [len(self.labels[a]) + 1 for a in axes]
+        keep = self.counts > 0
+        for a in axes:
+            keep &= self.cell_codes[a] < len(self.labels[a])
+        if len(axes) == 0:
+            group = np.zeros(keep.sum(), dtype=int)
+            groups, group_index = np.unique(group, return_inverse=True)
+            group_codes = []
+        else:
+            group = np.ravel_multi_index([self.cell_codes[a][keep] for a in axes], sizes)
+            groups, group_index = np.unique(group, return_inverse=True)
+            group_codes = np.unravel_index(groups, sizes)
+
+        # groups come out in label order of the first dimension, then the next
+        out = {d: np.asarray(self.labels[a])[codes]
+               for d, a, codes in zip(dimensions, axes, group_codes)}
+        out['count'] = np.bincount(group_index, weights=self.counts[keep],
+                                   minlength=len(groups)).astype(int)
+        for m in measures:
+            out[m] = np.bincount(group_index, weights=self.sums[m][keep],
+                                 minlength=len(groups))
+        return pd.DataFrame(out)
@@ -0,0 +1,93 @@
+import re
+
+import numpy as np
+
+token_pattern = re.compile(r'\w+')
+
+
+def tokenize(text):
+    if not isinstance(text, str):
+        return []
+    return token_pattern.findall(text.lower())
+
+
+def ngrams(token, n):
+    return {token[i:i + n] for i in range(len(token) - n + 1)}
+
+
+class SearchIndex:
+    """Inverted index over the words of the searchable text columns.
+
+    Each word maps to the row positions it appears in, and every 1 to
+    max_gram long piece of a word maps back to the words containing it, so
+    partial words are found without scanning the text. A query matches the
+    rows that contain every one of its terms.
+    """
+
+    def __init__(self, n_rows, max_gram=3):
+        self.n_rows = n_rows
+        self.max_gram = max_gram
+        self.vocabulary = []
+        self.postings = []
+        self.grams = dict()
+
+    @classmethod
+    def build(cls, df, cols, max_gram=3):
+        index = cls(len(df), max_gram=max_gram)
+        rows_by_token = dict()
+        for col in cols:
+            for position, text in enumerate(df[col].values):
+                for token in tokenize(text):
+                    rows_by_token.setdefault(token, set()).add(position)
+
+        grams = dict()
+        for token_id, (token, rows) in enumerate(rows_by_token.items()):
+            index.vocabulary.append(token)
+            index.postings.append(np.array(sorted(rows), dtype=np.int64))
+            for n in range(1, max_gram + 1):
+                for gram in ngrams(token, n):
+                    grams.setdefault(gram, []).append(token_id)
+        index.grams = {k: np.array(v, dtype=np.int64) for k, v in grams.items()}
+        return index
+
+    def match_tokens(self, term):
+        # ids of the words containing term
+        if len(term) <= self.max_gram:
+            return self.grams.get(term, np.empty(0, dtype=np.int64))
+        candidates = None
+        for gram in ngrams(term, self.max_gram):
+            token_ids = self.grams.get(gram)
+            if token_ids is None:
+                return np.empty(0, dtype=np.int64)
+            if candidates is None:
+                candidates = token_ids
+            else:
+                candidates = np.intersect1d(candidates, token_ids, assume_unique=True)
+        return np.array([i for i in candidates if term in self.vocabulary[i]], dtype=np.int64)
+
+    def match_term(self, term):
+        token_ids = self.match_tokens(term)
+        if len(token_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.postings[i] for i in token_ids]))
+
+    def positions(self, query):
+        # sorted, unique row positions containing every term of the query
+        terms = tokenize(query)
+        if len(terms) == 0:
+            return np.arange(self.n_rows)
+        positions = None
+        for term in sorted(set(terms), key=len, reverse=True):
+            rows = self.match_term(term)
+            if positions is None:
+                positions = rows
+            else:
+                positions = np.intersect1d(positions, rows, assume_unique=True)
+            if len(positions) == 0:
+                break
+        return positions
+
+    def mask(self, query):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.positions(query)] = True
+        return mask
@@ -0,0 +1,56 @@
+import threading
+from collections import OrderedDict
+
+import filter_cache
+
+
+class ResultStore:
+    """Filtered row positions kept on the server, keyed by a short token.
+
+    The browser only holds the token, which is the filter cache key of the
+    result: the rows are stored once, in the filter cache shared by the
+    workers, and this keeps the unpacked positions of recent tokens in
+    process. Unknown or expired tokens, and those of another version of the
+    dataset, give None; see overview_selection.selection_positions for how
+    callers get the rows back.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, token, positions, version=''):
+        positions.setflags(write=False)
+        with self._lock:
+            self._entries[token] = (version, positions)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return token
+
+    def _entry(self, token, version):
+        if token is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                self._entries.move_to_end(token)
+        if entry is None:
+            positions = filter_cache.cached_positions(token, version)
+            if positions is None:
+                return None
+            entry = (version, positions)
+            with self._lock:
+                self._entries[token] = entry
+        return entry if entry[0] == version else None
+
+    def get(self, token, version=''):
+        entry = self._entry(token, version)
+        return None if entry is None else entry[1]
+
+
+result_store = ResultStore()
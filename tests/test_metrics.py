@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+import metrics
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_read_workers_skips_exited_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'metrics_dir', str(tmp_path))
+    monkeypatch.setattr(metrics, 'cache_stats', lambda: {'filter': {'hits': 1, 'misses': 0}})
+    dead_path = tmp_path / f'{os.getppid()}-{exited_pid()}.json'
+    dead_path.write_text(json.dumps({'callbacks': {}, 'caches': {'filter': {'hits': 5, 'misses': 5}}}))
+
+    workers = metrics.read_workers()
+
+    assert len(workers) == 1
+    assert not dead_path.exists()
+    assert 'uipv_worker_processes 1\n' in metrics.render(workers)
+    assert 'uipv_cache_hits_total{cache="filter"} 1\n' in metrics.render(workers)
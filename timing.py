@@ -0,0 +1,32 @@
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTimer:
+    """Wall time of consecutive phases, e.g. of a worker's startup."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = []
+
+    def mark(self, phase):
+        # the time since the previous mark is booked to this phase
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        phases = ', '.join(f"{phase} {1000 * seconds:.0f} ms" for phase, seconds in self.phases)
+        return f"{self.name} (pid {os.getpid()}): {phases}; total {1000 * self.total:.0f} ms"
+
+    def log(self, level=logging.INFO):
+        logger.log(level, self.report())
@@ -1,6 +1,5 @@
 from dash import html, dcc
 from datetime import date
-import pandas as pd
 import numpy as np
 
 
@@ -20,6 +19,11 @@ def is_retrofit(built_year, plant_year):
         return 'Retrofit'
 
 
+def project_types(built_year, plant_year):
+    # vectorised is_retrofit
+    return np.where(np.asarray(built_year) == np.asarray(plant_year), 'New Build', 'Retrofit')
+
+
 def choose_colors(project_type):
     if project_type == 'Retrofit':
         return get_color_dict()['retrofit_cat']
@@ -125,10 +129,18 @@ def add_range_slider(min, max, id_name, marks=True):
 
 
 def add_compass_slider(id_name):
-    slider = dcc.RangeSlider(min=0,
+    # the track starts at -180 so ranges across North (e.g. -30 to 30,
+    # meaning 330-30) can be selected with an ordinary pair of handles
+    slider = dcc.RangeSlider(min=-180,
                              max=360,
                              step=1,
-                             marks={0: {'label': 'North',
+                             marks={-180: {'label': 'South',
+                                           # 'style': {'font-size': '5px'}
+                                           },
+                                    -90: {'label': 'West',
+                                          # 'style': {'font-size': '5px'}
+                                          },
+                                    0: {'label': 'North',
                                         # 'style': {'font-size': '5px'}
                                         },
                                     90: {'label': 'East',
@@ -153,9 +165,8 @@ def add_compass_slider(id_name):
     return slider
 
 
-def filter_df_range(df, range, col, new_dtype=int):
-    df[col] = df[col].astype(new_dtype)
-    return df[df[col].between(range[0], range[1])]
+def mask_df_range(df, range, col, new_dtype=int):
+    return df[col].astype(new_dtype).between(range[0], range[1]).values
 
 
 def add_checklist(df, col, id_name):
@@ -200,32 +211,45 @@ def add_filter_input(id_name):
     return input
 
 
-def filter_df_list(df, elements, col):
-    return df[df[col].isin(elements)]
-
-
-def filter_df_list_mixed_type(df, range, col, clip=None):
-    # # print(range)
-    # string_df = df[~df[col].astype(str).str.isnumeric()].copy()
-    # # print(len(string_df))
-    # num_df = df[df[col].astype(str).str.isnumeric()].copy()
-
-    def check_dig(s):
-        return str(s).replace('.', '', 1).isdigit()
+def split_mixed_type(series):
+    # numbers stored next to labels (roof, mixed, unknown) in one column:
+    # returns the numeric values (nan for labels) and the label mask
+    text = series.astype(str)
+    is_numeric = text.str.fullmatch(r'\d+\.?\d*|\.\d+').values.astype(bool)
+    values = np.full(len(series), np.nan)
+    values[is_numeric] = text[is_numeric].astype(float).values
+    return values, ~is_numeric
+
+
+def mask_numeric_range(values, is_label, range, clip=None):
+    # labels always pass the filter
+    if clip != None:
+        values = np.clip(values, clip[0], clip[1])
+    with np.errstate(invalid='ignore'):
+        in_range = (values >= range[0]) & (values <= range[1])
+    return is_label | in_range
+
+
+def mask_angle_range(angles, is_label, range):
+    # angles are in [0, 360); a range whose ends fall either side of North
+    # after wrapping (e.g. -30 to 30, or 330 to 30) selects across North
+    low, high = range
+    if high - low >= 360:
+        return np.ones(len(angles), dtype=bool)
+    low, high = low % 360, high % 360
+    with np.errstate(invalid='ignore'):
+        if low <= high:
+            in_range = (angles >= low) & (angles <= high)
+        else:
+            in_range = (angles >= low) | (angles <= high)
+    return is_label | in_range
 
-    string_df = df[~df.apply(lambda x: check_dig(x[col]), axis=1)].copy()
-    num_df = df[df.apply(lambda x: check_dig(x[col]), axis=1)].copy()
 
-    if clip == None:
-        num_df = filter_df_range(num_df, range, col, new_dtype=int)
-    else:
-        clipped = pd.Series(np.clip(num_df[col].astype(float),
-                                    clip[0],
-                                    clip[1]))
-        num_df = num_df[clipped.between(range[0], range[1])]
-    out_df = pd.concat([string_df,
-                        num_df])
-    return out_df
+def display_value(value):
+    # float32 columns print with their shortest repr rather than the widened float64
+    if isinstance(value, np.floating):
+        return float(str(value))
+    return value
 
 
 def map_dict_names(map_dict, key):
@@ -233,23 +257,3 @@ def map_dict_names(map_dict, key):
         return map_dict[key]
     else:
         return key
-
-
-def search_string_field(df, cols, search_term):
-    if type(cols) != list:
-        cols = list(cols)
-    else:
-        pass
-
-    if search_term == None:
-        return df
-    else:
-        if len(cols) == 1:
-            out_df = df[df[cols[0]].str.lower().str.contains(search_term.lower())]
-        else:
-            desc_df_list = []
-            for col in cols:
-                desc_df_list.append(df[df[col].str.lower().str.contains(search_term.lower())])
-            out_df = pd.concat(desc_df_list, axis=0)
-
-        return out_df